@@ -47,7 +47,7 @@ class TagAdmin(admin.ModelAdmin):
 
 @admin.register(Article)
 class ArticleAdmin(admin.ModelAdmin):
-    list_display = ('title', 'on_top', 'status', 'pvs', 'uvs', 'created', 'modified')
+    list_display = ('title', 'on_top', 'status', 'render_status', 'pvs', 'uvs', 'created', 'modified')
     list_filter = ('status', 'created', 'modified')
     prepopulated_fields = {"slug": ("title", )}
     search_fields = ('title', 'content')
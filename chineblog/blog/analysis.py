@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import re
+import io
+import threading
+
+from django.conf import settings
+from whoosh.analysis import Tokenizer, Token, LowercaseFilter, StopFilter, \
+    StandardAnalyzer
+
+
+_cjk = u'\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_token_re = re.compile(u'([%s]+)|(\\w+)' % _cjk, re.UNICODE)
+
+# the dictionary lives in the module, so that it is loaded once before
+# the workers fork and is never pickled along with the schema
+_dictionary = None
+_max_word_len = 1
+_lock = threading.Lock()
+
+
+def load_dictionary(path=None):
+    """
+    Load the words used by the segmentation, one word per line,
+    the format of jieba where the frequency and tag follow the word
+    is accepted as well.
+    """
+    global _dictionary, _max_word_len
+
+    with _lock:
+        if _dictionary is not None and path is None:
+            return _dictionary
+        path = path or settings.SEARCH_DICTIONARY
+
+        words = set()
+        if path:
+            with io.open(path, encoding='utf-8') as f:
+                for line in f:
+                    parts = line.split()
+                    if parts:
+                        words.add(parts[0])
+        _dictionary = frozenset(words)
+        _max_word_len = max([len(w) for w in words] or [1])
+        return _dictionary
+
+
+def get_dictionary():
+    if _dictionary is None:
+        load_dictionary()
+    return _dictionary
+
+
+def segment(text, ngram=2):
+    """
+    Forward maximum matching against the dictionary, the runs of
+    characters not covered by any word are split into n-grams.
+    Yields ``(word, start, end)``.
+    """
+    words = get_dictionary()
+    size = len(text)
+    i = 0
+    unmatched = None
+
+    while i < size:
+        word_len = 0
+        if words:
+            for l in range(min(_max_word_len, size - i), 1, -1):
+                if text[i:i + l] in words:
+                    word_len = l
+                    break
+
+        if word_len:
+            if unmatched is not None:
+                for gram in _ngrams(text, unmatched, i, ngram):
+                    yield gram
+                unmatched = None
+            yield text[i:i + word_len], i, i + word_len
+            i += word_len
+        else:
+            if unmatched is None:
+                unmatched = i
+            i += 1
+
+    if unmatched is not None:
+        for gram in _ngrams(text, unmatched, size, ngram):
+            yield gram
+
+
+def _ngrams(text, start, end, n):
+    if end - start <= n:
+        yield text[start:end], start, end
+        return
+    for i in range(start, end - n + 1):
+        yield text[i:i + n], i, i + n
+
+
+class ChineseTokenizer(Tokenizer):
+    """
+    Splits CJK runs with :func:`segment`, other words are kept whole.
+    """
+
+    def __init__(self, ngram=2):
+        self.ngram = ngram
+
+    def __eq__(self, other):
+        return other.__class__ is self.__class__ and other.ngram == self.ngram
+
+    def __call__(self, value, positions=False, chars=False, keeporiginal=False,
+                 removestops=True, start_pos=0, start_char=0, tokenize=True,
+                 mode='', **kwargs):
+        t = Token(positions, chars, removestops=removestops, mode=mode, **kwargs)
+
+        if not tokenize:
+            t.original = t.text = value
+            t.boost = 1.0
+            if positions:
+                t.pos = start_pos
+            if chars:
+                t.startchar = start_char
+                t.endchar = start_char + len(value)
+            yield t
+            return
+
+        pos = start_pos
+        for match in _token_re.finditer(value):
+            if match.group(1):
+                offset = match.start()
+                pieces = ((w, s + offset, e + offset)
+                          for w, s, e in segment(match.group(1), self.ngram))
+            else:
+                pieces = ((match.group(2), match.start(), match.end()), )
+
+            for word, start, end in pieces:
+                t.text = word
+                t.boost = 1.0
+                t.stopped = False
+                if keeporiginal:
+                    t.original = word
+                if positions:
+                    t.pos = pos
+                    pos += 1
+                if chars:
+                    t.startchar = start_char + start
+                    t.endchar = start_char + end
+                yield t
+
+
+def ChineseAnalyzer(ngram=2):
+    # single characters are meaningful words in chinese, keep them
+    return ChineseTokenizer(ngram=ngram) | LowercaseFilter() | StopFilter(minsize=1)
+
+
+def get_analyzer(name=None):
+    name = name or settings.SEARCH_ANALYZER
+    if name == 'cjk':
+        return ChineseAnalyzer()
+    elif name == 'standard':
+        return StandardAnalyzer()
+    raise ValueError('Unknown search analyzer: %s' % name)
@@ -27,3 +27,15 @@ class BlogConfig(AppConfig):
     def ready(self):
         # just import to activate signals
         from .signals import send_email, index_article
+
+        from django.conf import settings
+
+        # deliver the mails spooled before a restart
+        if settings.ENABLE_EMAIL:
+            from .mail import mail_queue
+            mail_queue.start()
+
+        # load the segmentation words before the workers fork
+        if settings.SEARCH_ANALYZER == 'cjk':
+            from .analysis import load_dictionary
+            load_dictionary()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import io
+import os
+import re
+import json
+import gzip
+import hashlib
+import tempfile
+import posixpath
+import threading
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+
+from .utils import to_binary, to_text
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+MANIFEST_NAME = 'manifest.json'
+
+# worth compressing, the images and woff fonts are compressed already
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.ttf', '.otf', '.eot', '.ico')
+
+CSS_IMPORT_RE = re.compile(
+    r'''@import\s+(?:url\(\s*)?(['"]?)([^'")\s;]+)\1\s*\)?\s*([^;]*);''')
+CSS_URL_RE = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def is_local(url):
+    return not (url.startswith(('data:', '#', '/')) or '://' in url)
+
+
+def hashed_name(name, content):
+    root, ext = posixpath.splitext(name)
+    return '%s.%s%s' % (root, hashlib.md5(content).hexdigest()[:12], ext)
+
+
+def gzip_compress(content):
+    buf = io.BytesIO()
+    # mtime is fixed so that the same content gives the same file
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buf,
+                       compresslevel=9, mtime=0) as fp:
+        fp.write(content)
+    return buf.getvalue()
+
+
+class AssetBuilder(object):
+    """
+    Builds the bundles of ``ASSET_BUNDLES`` into ``build_dir``.
+
+    The sources of a bundle are concatenated and minified when rcssmin
+    and rjsmin are installed. Local ``@import`` of the stylesheets are
+    inlined, the files referred by ``url()`` are copied with their
+    fingerprint too. Every file is named after the hash of its content
+    and gets ``.gz`` and ``.br`` siblings when they are smaller. The
+    manifest maps the names used in the templates to the built files.
+    """
+
+    def __init__(self, build_dir, bundles, build_url):
+        self.build_dir = build_dir
+        self.bundles = bundles
+        self.build_url = build_url
+        self.manifest = {}
+
+    def find(self, path):
+        source = finders.find(path)
+        if source is None:
+            raise ValueError('Asset not found: %s' % path)
+        return source
+
+    def read(self, path):
+        with open(self.find(path), 'rb') as fp:
+            return fp.read()
+
+    def build(self):
+        for name, sources in sorted(self.bundles.items()):
+            ext = posixpath.splitext(name)[1]
+            if ext == '.css':
+                content = self.build_css(sources)
+            elif ext == '.js':
+                content = self.build_js(sources)
+            else:
+                content = b''.join(self.read(path) for path in sources)
+            self.manifest[name] = self.emit(name, content)
+
+        self.write_manifest()
+        return self.manifest
+
+    def build_js(self, sources):
+        parts = []
+        for path in sources:
+            js = to_text(self.read(path))
+            if rjsmin is not None:
+                js = rjsmin.jsmin(js, keep_bang_comments=True)
+            # guard against a source missing its last semicolon
+            parts.append(js.rstrip().rstrip(';') + ';')
+        return to_binary('\n'.join(parts))
+
+    def build_css(self, sources):
+        remote_imports, parts = [], []
+        for path in sources:
+            parts.append(self._read_css(path, remote_imports, set()))
+        # @import is only allowed at the top of a stylesheet
+        css = '\n'.join(remote_imports + parts)
+        if rcssmin is not None:
+            css = rcssmin.cssmin(css, keep_bang_comments=True)
+        return to_binary(css)
+
+    def _read_css(self, path, remote_imports, seen):
+        if path in seen:
+            return ''
+        seen.add(path)
+        css = to_text(self.read(path))
+
+        def inline(match):
+            url, media = match.group(2), match.group(3).strip()
+            if not is_local(url) or media:
+                remote_imports.append(match.group(0))
+                return ''
+            imported = posixpath.normpath(posixpath.join(posixpath.dirname(path), url))
+            return self._read_css(imported, remote_imports, seen)
+
+        css = CSS_IMPORT_RE.sub(inline, css)
+        return self._rewrite_urls(path, css)
+
+    def _rewrite_urls(self, path, css):
+        def rewrite(match):
+            quote, url = match.groups()
+            if not is_local(url):
+                return match.group(0)
+            split = min(i for i in (url.find('?'), url.find('#'), len(url)) if i >= 0)
+            target = posixpath.normpath(posixpath.join(posixpath.dirname(path), url[:split]))
+            if finders.find(target) is None:
+                return match.group(0)
+            name = self.manifest.get(target)
+            if name is None:
+                name = self.manifest[target] = self.emit(target, self.read(target))
+            return 'url(%s%s%s%s%s)' % (quote, self.build_url, name, url[split:], quote)
+
+        return CSS_URL_RE.sub(rewrite, css)
+
+    def emit(self, name, content):
+        hashed = hashed_name(name, content)
+        dest = os.path.join(self.build_dir, *hashed.split('/'))
+        if os.path.exists(dest):
+            # same name, same content
+            return hashed
+
+        dirname = os.path.dirname(dest)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self._write(dest, content)
+        if posixpath.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+            compressed = gzip_compress(content)
+            if len(compressed) < len(content):
+                self._write(dest + '.gz', compressed)
+            if brotli is not None:
+                compressed = brotli.compress(content, quality=11)
+                if len(compressed) < len(content):
+                    self._write(dest + '.br', compressed)
+        return hashed
+
+    def _write(self, dest, content):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest))
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(content)
+        # mkstemp creates the file only readable by its owner
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, dest)
+
+    def write_manifest(self):
+        if not os.path.exists(self.build_dir):
+            os.makedirs(self.build_dir)
+        content = json.dumps(self.manifest, indent=2, sort_keys=True)
+        self._write(os.path.join(self.build_dir, MANIFEST_NAME), to_binary(content))
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_manifest():
+    global _manifest
+
+    if _manifest is None:
+        with _manifest_lock:
+            if _manifest is None:
+                path = os.path.join(settings.ASSET_BUILD_DIR, MANIFEST_NAME)
+                try:
+                    with open(path, 'rb') as fp:
+                        _manifest = json.loads(to_text(fp.read()))
+                except (IOError, OSError):
+                    # not built, the sources are served as they are
+                    _manifest = {}
+    return _manifest
+
+
+def reset_manifest():
+    global _manifest
+
+    with _manifest_lock:
+        _manifest = None
+
+
+def asset_url(name):
+    hashed = get_manifest().get(name)
+    if hashed is None:
+        return settings.STATIC_URL + name
+    return settings.ASSET_BUILD_URL + hashed
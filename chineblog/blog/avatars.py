@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import re
+
+from django.conf import settings
+
+
+AVATAR_ATTR_RE = re.compile(r'^avatar_([0-9]+)$')
+GRAVATAR_PREFIXES = ('http://www.gravatar.com/', 'https://www.gravatar.com/',
+                     'https://secure.gravatar.com/')
+
+
+def avatar_url(avatar, size):
+    """
+    Url of ``avatar`` displayed in ``size`` pixels, only the gravatar
+    ones can be resized.
+    """
+    if not avatar or not avatar.startswith(GRAVATAR_PREFIXES):
+        return avatar
+    return '%s?s=%s&d=404' % (avatar.split('?')[0], size)
+
+
+def resolve_avatars(comments, sizes=None):
+    """
+    Set ``avatar_<size>`` of each comment and its replies at once,
+    so that templates never go through ``Comment.__getattr__``.
+    """
+    sizes = sizes or settings.AVATAR_SIZES
+    for comment in comments:
+        avatar = comment.avatar
+        for size in sizes:
+            comment.__dict__['avatar_%s' % size] = avatar_url(avatar, size)
+        replies = comment.__dict__.get('replies')
+        if replies:
+            resolve_avatars(replies, sizes)
+    return comments
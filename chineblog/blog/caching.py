@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+import threading
+from collections import OrderedDict, defaultdict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from .utils import to_binary
+
+
+SIDEBAR_KEY = 'blog:sidebar'
+POPULARS_KEY = 'blog:sidebar:populars'
+PAGE_GENERATION_KEY = 'blog:page:generation:%s'
+COMMENT_TREE_KEY = 'blog:comments:%s:%s'
+PAGINATION_KEY = 'blog:pagination:%s'
+TAG_CLOUD_KEY = 'blog:tagcloud'
+WATERMARK_KEY = 'blog:watermark'
+
+CSRF_PLACEHOLDER = b'__blog_csrf_token__'
+
+
+class CacheStats(object):
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    @property
+    def miss_ratio(self):
+        total = self.hits + self.misses
+        return float(self.misses) / total if total else 0.0
+
+    def reset(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def __repr__(self):
+        return '<CacheStats %s: %s hits, %s misses>' % (self.name, self.hits, self.misses)
+
+
+sidebar_stats = CacheStats('sidebar')
+page_stats = CacheStats('page')
+
+
+class LRUCache(object):
+    """
+    Thread-safe in-process LRU cache.
+
+    Entries may carry their own timeout and a set of tags that can be
+    invalidated together. When ``max_bytes`` is given, ``sizeof`` is
+    used to measure each value and the least recently used entries are
+    evicted to stay under the bound.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, timeout=None, sizeof=len):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.sizeof = sizeof
+        self.size = 0
+
+        self._data = OrderedDict()
+        self._tags = defaultdict(set)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                entry = self._data[key]
+            except KeyError:
+                return default
+            expires = entry[1]
+            if expires is not None and expires <= time.time():
+                self._delete(key)
+                return default
+            # move to the most recently used end
+            del self._data[key]
+            self._data[key] = entry
+            return entry[0]
+
+    def set(self, key, value, timeout=None, tags=()):
+        timeout = self.timeout if timeout is None else timeout
+        expires = time.time() + timeout if timeout else None
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._data:
+                self._delete(key)
+            self._data[key] = value, expires, size, tuple(tags)
+            self.size += size
+            for tag in tags:
+                self._tags[tag].add(key)
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._delete(key)
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in list(self._tags.pop(tag, ())):
+                if key in self._data:
+                    self._delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+            self.size = 0
+
+    def _delete(self, key):
+        _, _, size, tags = self._data.pop(key)
+        self.size -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _evict(self):
+        while self._data and (
+                (self.max_entries is not None and len(self._data) > self.max_entries) or
+                (self.max_bytes is not None and self.size > self.max_bytes)):
+            self._delete(next(iter(self._data)))
+
+
+class PageCache(object):
+    """
+    Rendered pages of anonymous GETs.
+
+    Bodies live in a per-process LRU, each entry remembers the
+    generation of its tags which are kept in the shared cache, so that
+    a save in one process also invalidates the pages of the others.
+    """
+
+    def __init__(self):
+        self._pages = None
+
+    @property
+    def pages(self):
+        if self._pages is None:
+            self._pages = LRUCache(max_bytes=settings.PAGE_CACHE_MAX_BYTES,
+                                   timeout=settings.PAGE_CACHE_TIMEOUT,
+                                   sizeof=lambda entry: len(entry[0]))
+        return self._pages
+
+    def _generations(self, tags):
+        keys = dict((PAGE_GENERATION_KEY % tag, tag) for tag in tags)
+        values = cache.get_many(keys.keys())
+        return dict((tag, values.get(key, 0)) for key, tag in keys.items())
+
+    def get(self, key):
+        entry = self.pages.get(key)
+        if entry is None:
+            return
+        content, content_type, uses_csrf, generations = entry
+        if generations and self._generations(generations.keys()) != generations:
+            self.pages.delete(key)
+            return
+        return content, content_type, uses_csrf
+
+    def set(self, key, content, content_type, uses_csrf, tags=(), timeout=None):
+        entry = content, content_type, uses_csrf, self._generations(tags)
+        self.pages.set(key, entry, timeout=timeout, tags=tags)
+
+    def invalidate(self, tag):
+        self.pages.invalidate(tag)
+        key = PAGE_GENERATION_KEY % tag
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+    def clear(self):
+        self.pages.clear()
+
+
+page_cache = PageCache()
+
+
+def cache_page_response(tags, timeout=None):
+    """
+    Cache the responses of anonymous GETs to the decorated view.
+
+    ``tags`` are model names, the pages are dropped when one of those
+    models is saved or deleted. The csrf token is swapped out of the
+    cached body and the token of the current visitor is put back when
+    the page is served.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            if not settings.PAGE_CACHE_ENABLED or request.method != 'GET' or \
+                    request.user.is_authenticated():
+                return view(request, *args, **kwargs)
+
+            key = (settings.BLOG_THEME, view.__name__, args,
+                   tuple(sorted(kwargs.items())), request.get_full_path())
+            entry = page_cache.get(key)
+            if entry is not None:
+                page_stats.hit()
+                content, content_type, uses_csrf = entry
+                if uses_csrf:
+                    content = content.replace(CSRF_PLACEHOLDER, to_binary(get_token(request)))
+                return HttpResponse(content, content_type=content_type)
+
+            page_stats.miss()
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming and \
+                    not response.cookies:
+                content = response.content
+                uses_csrf = bool(request.META.get('CSRF_COOKIE_USED'))
+                if uses_csrf:
+                    token = to_binary(get_token(request))
+                    content = content.replace(token, CSRF_PLACEHOLDER)
+                page_cache.set(key, content, response['Content-Type'], uses_csrf,
+                               tags=tags, timeout=timeout)
+            return response
+
+        return inner
+
+    return decorator
+
+
+def cached(key, builder, timeout=None, stats=None):
+    """
+    Get ``key`` from the cache, call ``builder`` to fill it on a miss.
+    """
+    value = cache.get(key)
+    if value is None:
+        if stats is not None:
+            stats.miss()
+        value = builder()
+        cache.set(key, value, timeout)
+    elif stats is not None:
+        stats.hit()
+    return value
+
+
+def invalidate_sidebar():
+    cache.delete(SIDEBAR_KEY)
+
+
+def invalidate_populars():
+    cache.delete(POPULARS_KEY)
+
+
+def invalidate_tag_cloud():
+    cache.delete(TAG_CLOUD_KEY)
+
+
+def invalidate_pagination(name):
+    cache.delete(PAGINATION_KEY % name)
+
+
+def invalidate_comment_tree(content_type_id, object_id):
+    cache.delete(COMMENT_TREE_KEY % (content_type_id, object_id))
+
+
+def bump_watermark():
+    # whole seconds as in Last-Modified, moved by at least one second so
+    # that two changes within the same second give two watermarks
+    current = cache.get(WATERMARK_KEY)
+    now = int(time.time())
+    cache.set(WATERMARK_KEY, now if current is None else max(now, current + 1), None)
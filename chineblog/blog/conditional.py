@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import calendar
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import Max
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from .models import Article, Comment
+from .caching import cached, WATERMARK_KEY
+from .utils import to_binary
+
+
+def timestamp(dt):
+    return calendar.timegm(dt.utctimetuple())
+
+
+def _compute_watermark():
+    dates = [Article.objects.aggregate(date=Max('modified'))['date'],
+             Comment.objects.aggregate(date=Max('post_date'))['date']]
+    return max([timestamp(d) for d in dates if d is not None] or [0])
+
+
+def get_watermark():
+    """
+    Time of the last change of the content shown by the blog pages.
+    Computed from the newest ``modified`` and ``post_date`` when missing
+    from the cache, then moved forward by the signals on every save.
+    """
+    return cached(WATERMARK_KEY, _compute_watermark)
+
+
+def not_modified(request, etag, last_modified):
+    """
+    Whether the validators sent by the client still match, the ETag is
+    preferred when given. ``last_modified`` is a timestamp in seconds.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or \
+            etag in [e.strip() for e in if_none_match.split(',')]
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and last_modified is not None and \
+        last_modified <= if_modified_since
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # cached by the clients but revalidated on each use
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def conditional_page(view):
+    """
+    Answer the anonymous GETs with a 304 before calling the view, when
+    the client holds the page of the current watermark.
+    """
+
+    @wraps(view)
+    def inner(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated():
+            return view(request, *args, **kwargs)
+
+        watermark = get_watermark()
+        etag = quote_etag(hashlib.md5(to_binary('%s:%s:%s' % (
+            settings.BLOG_THEME, watermark, request.get_full_path()))).hexdigest())
+        if not_modified(request, etag, watermark):
+            return set_validators(HttpResponseNotModified(), etag, watermark)
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.has_header('ETag'):
+            set_validators(response, etag, watermark)
+        return response
+
+    return inner
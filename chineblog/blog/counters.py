@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, connection
+from django.db.models import F, Count
+
+from .sketches import BloomFilter, HyperLogLog
+from .caching import invalidate_sidebar, invalidate_tag_cloud, page_cache
+
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class CounterBuffer(object):
+    """
+    Write-behind buffer for counter columns.
+
+    Deltas are gathered in memory per primary key and written back
+    with ``F()`` updates by a background thread every
+    ``COUNTER_FLUSH_INTERVAL`` seconds, rows sharing the same deltas
+    are updated in one statement. When ``COUNTER_SPOOL_FILE`` is set,
+    the deltas of a failed flush are kept in that file, which is locked
+    while flushing, and retried by the next flush of any process.
+    """
+
+    def __init__(self, model, fields, interval=None, spool_file=None):
+        self.model = model
+        self.fields = tuple(fields)
+        self.interval = interval
+        self.spool_file = spool_file
+
+        self._lock = threading.Lock()
+        self._deltas = defaultdict(lambda: defaultdict(int))
+        self._worker = None
+
+    def get_model(self):
+        return apps.get_model(self.model)
+
+    def get_interval(self):
+        if self.interval is not None:
+            return self.interval
+        return settings.COUNTER_FLUSH_INTERVAL
+
+    def get_spool_file(self):
+        return self.spool_file or settings.COUNTER_SPOOL_FILE
+
+    def add(self, pk, **deltas):
+        with self._lock:
+            counter = self._deltas[pk]
+            for field, delta in deltas.items():
+                if field not in self.fields:
+                    raise ValueError('Unknown counter field: %s' % field)
+                counter[field] += delta
+
+        # only the worker flushes, the requests never wait on the database
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name='blog-counters')
+                    self._worker.daemon = True
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.get_interval())
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush the counters of %s', self.model)
+            finally:
+                # the connection of this thread would stay open otherwise
+                connection.close()
+
+    def pending(self, pk):
+        with self._lock:
+            return dict(self._deltas.get(pk, {}))
+
+    def _take(self):
+        with self._lock:
+            deltas, self._deltas = self._deltas, defaultdict(lambda: defaultdict(int))
+        return deltas
+
+    def _merge_spool(self, deltas, fp):
+        fp.seek(0)
+        for line in fp:
+            parts = line.split()
+            if len(parts) != len(self.fields) + 1:
+                continue
+            counter = deltas[int(parts[0])]
+            for field, delta in zip(self.fields, parts[1:]):
+                counter[field] += int(delta)
+
+    def _write_spool(self, deltas, fp):
+        fp.seek(0)
+        fp.truncate()
+        for pk, counter in deltas.items():
+            values = [str(counter.get(field, 0)) for field in self.fields]
+            fp.write('%s %s\n' % (pk, ' '.join(values)))
+        fp.flush()
+
+    def _apply(self, deltas):
+        batches = defaultdict(list)
+        for pk, counter in deltas.items():
+            key = tuple((field, counter.get(field, 0)) for field in self.fields)
+            if any(delta for _, delta in key):
+                batches[key].append(pk)
+
+        model = self.get_model()
+        with transaction.atomic():
+            for key, pks in batches.items():
+                updates = dict((field, F(field) + delta)
+                               for field, delta in key if delta)
+                model.objects.filter(pk__in=pks).update(**updates)
+
+    def flush(self):
+        deltas = self._take()
+
+        spool_file = self.get_spool_file()
+        if not spool_file:
+            if deltas:
+                try:
+                    self._apply(deltas)
+                except Exception:
+                    self._restore(deltas)
+                    raise
+            return
+
+        # created without truncating, other processes may have written it
+        fd = os.open(spool_file, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, 'r+') as fp:
+            if fcntl is not None:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                self._merge_spool(deltas, fp)
+                try:
+                    self._apply(deltas)
+                except Exception:
+                    # keep the deltas in the spool for the next flush
+                    self._write_spool(deltas, fp)
+                    raise
+                self._write_spool({}, fp)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def _restore(self, deltas):
+        with self._lock:
+            for pk, counter in deltas.items():
+                for field, delta in counter.items():
+                    self._deltas[pk][field] += delta
+
+
+class VisitorEstimator(object):
+    """
+    Per-object unique visitor estimation, one HyperLogLog
+    kept in the cache for each object.
+    """
+
+    def __init__(self, prefix, precision=None):
+        self.prefix = prefix
+        self.precision = precision
+
+    def get_precision(self):
+        return self.precision or settings.UV_HLL_PRECISION
+
+    def _key(self, pk):
+        return '%s:%s' % (self.prefix, pk)
+
+    def get(self, pk):
+        data = cache.get(self._key(pk))
+        if data is None:
+            return HyperLogLog(precision=self.get_precision())
+        return HyperLogLog.loads(data, precision=self.get_precision())
+
+    def add(self, pk, visitor):
+        hll = self.get(pk)
+        if hll.add(visitor):
+            # only written back when a register grows
+            cache.set(self._key(pk), hll.dumps(), None)
+
+    def count(self, pk):
+        return self.get(pk).count()
+
+
+def session_filter(session, key):
+    """
+    Get the bloom filter stored in the session under ``key``,
+    lists of pks kept by former versions are converted.
+    """
+    bits, hashes = settings.SESSION_BLOOM_BITS, settings.SESSION_BLOOM_HASHES
+    value = session.get(key, None)
+    if value is None:
+        return BloomFilter(bits=bits, hashes=hashes)
+    if isinstance(value, (list, tuple)):
+        bloom = BloomFilter(bits=bits, hashes=hashes)
+        for pk in value:
+            bloom.add(pk)
+        return bloom
+    return BloomFilter.loads(value, bits=bits, hashes=hashes)
+
+
+def _count_visible(field, pks):
+    Article = apps.get_model('blog', 'Article')
+    counts = dict.fromkeys(pks, 0)
+    rows = Article.objects.filter(status=2, **{'%s__in' % field: pks}) \
+        .order_by().values(field).annotate(count=Count('pk', distinct=True))
+    for row in rows:
+        counts[row[field]] = row['count']
+    return counts
+
+
+def refresh_article_counts(category_pks=(), tag_pks=()):
+    """
+    Recompute ``article_count`` of the given categories and tags from
+    the visible articles, in one transaction.
+
+    ``update()`` sends no signal, so the sidebar, the tag cloud and the
+    cached pages showing the cloud are invalidated here.
+    """
+    Category = apps.get_model('blog', 'Category')
+    Tag = apps.get_model('blog', 'Tag')
+
+    category_pks = [pk for pk in set(category_pks) if pk is not None]
+    tag_pks = [pk for pk in set(tag_pks) if pk is not None]
+
+    with transaction.atomic():
+        for model, field, pks in ((Category, 'category', category_pks),
+                                  (Tag, 'articletag__tag', tag_pks)):
+            if not pks:
+                continue
+            by_count = defaultdict(list)
+            for pk, count in _count_visible(field, pks).items():
+                by_count[count].append(pk)
+            for count, pks_ in by_count.items():
+                model.objects.filter(pk__in=pks_).update(article_count=count)
+
+    if category_pks or tag_pks:
+        invalidate_sidebar()
+        invalidate_tag_cloud()
+        page_cache.invalidate('tag')
+
+
+article_visitors = VisitorEstimator('blog:article:hll')
+article_counters = CounterBuffer('blog.Article', ('pvs', 'uvs', 'likes'))
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        article_counters.flush()
+    except Exception:
+        # the deltas are lost unless COUNTER_SPOOL_FILE keeps them
+        logger.exception('Failed to flush the counters at exit')
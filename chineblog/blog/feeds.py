@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Count
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.feedgenerator import Rss201rev2Feed, Atom1Feed
+from django.utils.http import quote_etag
+from django.utils.xmlutils import SimplerXMLGenerator
+
+from .caching import PAGE_GENERATION_KEY
+from .conditional import get_watermark, not_modified, set_validators
+from .utils import to_binary
+
+
+FEED_KEY = 'blog:feed:%s'
+
+
+class _Chunks(object):
+    # file-like object of the xml generator, drained between the items
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(to_binary(data))
+
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+class StreamingFeedMixin(object):
+    """
+    Writes the feed item by item so that the items can be produced lazily
+    from a queryset iterator, instead of being built in memory first.
+    """
+
+    # opened before the items and closed after them, outermost first,
+    # with the method giving the attributes of each
+    root_elements = ()
+    item_element = None
+
+    def latest_post_date(self):
+        return self.feed.get('last_modified') or super(StreamingFeedMixin, self).latest_post_date()
+
+    def stream(self, items, encoding='utf-8'):
+        out = _Chunks()
+        handler = SimplerXMLGenerator(out, encoding)
+        handler.startDocument()
+        for name, attributes in self.root_elements:
+            handler.startElement(name, getattr(self, attributes)())
+        self.add_root_elements(handler)
+        yield out.drain()
+
+        for kwargs in items:
+            self.items = []
+            self.add_item(**kwargs)
+            item = self.items[0]
+            handler.startElement(self.item_element, self.item_attributes(item))
+            self.add_item_elements(handler, item)
+            handler.endElement(self.item_element)
+            yield out.drain()
+
+        for name, _ in reversed(self.root_elements):
+            handler.endElement(name)
+        yield out.drain()
+
+
+class RssFeed(StreamingFeedMixin, Rss201rev2Feed):
+    root_elements = (('rss', 'rss_attributes'), ('channel', 'root_attributes'))
+    item_element = 'item'
+
+
+class AtomFeed(StreamingFeedMixin, Atom1Feed):
+    root_elements = (('feed', 'root_attributes'), )
+    item_element = 'entry'
+
+
+FEED_TYPES = {
+    'rss': RssFeed,
+    'atom': AtomFeed,
+}
+
+
+def feed_watermark(articles):
+    """
+    Newest ``modified`` and count of ``articles`` in one aggregate,
+    the count catches the articles which are hidden or deleted.
+    """
+    agg = articles.order_by().aggregate(last_modified=Max('modified'), count=Count('pk'))
+    return agg['last_modified'], agg['count']
+
+
+def _items(request, articles):
+    articles = articles.select_related('author__user').only(
+        'pk', 'title', 'slug', 'abstract', 'summary', 'created', 'modified',
+        'author__user__username')
+
+    for article in articles:
+        yield {
+            'title': article.title,
+            'link': request.build_absolute_uri(article.get_absolute_url()),
+            'description': article.abstract or article.summary or '',
+            'author_name': article.author.user.username,
+            'pubdate': article.created,
+            'updateddate': article.modified,
+            'unique_id': request.build_absolute_uri(article.get_absolute_url()),
+        }
+
+
+def feed_response(request, feed_type, name, title, link, articles, description=''):
+    """
+    Response of the feed of the visible ``articles``.
+
+    The ETag comes from the newest ``modified``, the count and the page
+    generation, which saves of the articles bump, pollers holding the
+    current version get a 304 after one aggregate query. ``modified`` is
+    not touched by every edit, so Last-Modified is the watermark of the
+    blog rather than the newest ``modified``. The body is streamed and
+    kept in the cache for the other pollers, it holds absolute links so
+    the scheme and the host are part of the ETag and of the cache key.
+    """
+    feed_class = FEED_TYPES[feed_type]
+    newest, count = feed_watermark(articles)
+    # the generation is bumped when a displayed field of an article changes
+    generation = cache.get(PAGE_GENERATION_KEY % 'article', 0)
+    etag = quote_etag(hashlib.md5(to_binary('%s:%s:%s:%s:%s:%s:%s:%s' % (
+        request.scheme, request.get_host(), feed_type, name, title,
+        newest and newest.isoformat(), count, generation))).hexdigest())
+    last_modified = get_watermark()
+
+    if not_modified(request, etag, last_modified):
+        return set_validators(HttpResponseNotModified(), etag, last_modified)
+
+    key = FEED_KEY % etag.strip('"')
+    body = cache.get(key)
+    if body is not None:
+        response = HttpResponse(body, content_type=feed_class.content_type)
+    else:
+        feed = feed_class(title=title, link=request.build_absolute_uri(link),
+                          description=description, feed_url=request.build_absolute_uri(request.path),
+                          last_modified=newest)
+        items = _items(request, articles.order_by('-created')[:settings.FEED_SIZE])
+        response = StreamingHttpResponse(_cache_stream(key, feed.stream(items)),
+                                         content_type=feed_class.content_type)
+    return set_validators(response, etag, last_modified)
+
+
+def _cache_stream(key, chunks):
+    # the body is only cached once it was streamed completely
+    body = []
+    for chunk in chunks:
+        body.append(chunk)
+        yield chunk
+    cache.set(key, b''.join(body), settings.FEED_CACHE_TIMEOUT)
@@ -17,29 +17,310 @@ limitations under the License.
 """
 
 
-from django.core.mail import EmailMultiAlternatives
+import json
+import time
+import logging
+import sqlite3
 import threading
 
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.utils.html import linebreaks
 
-class EmailThread(threading.Thread):
-    def __init__(self, subject, body,
-                 from_email, recipient_list,
-                 fail_silently, html):
-        self.subject = subject
-        self.body = body
-        self.recipient_list = recipient_list
-        self.from_email = from_email
-        self.fail_silently = fail_silently
-        self.html = html
-        threading.Thread.__init__(self)
 
-    def run(self):
-        msg = EmailMultiAlternatives(self.subject, self.body, self.from_email, self.recipient_list)
-        if self.html:
-            msg.attach_alternative(self.html, "text/html")
-        msg.send(self.fail_silently)
+logger = logging.getLogger(__name__)
+
+
+class MailSpool(object):
+    """
+    Pending mails kept in a local SQLite file, so that they survive
+    restarts. Rows are claimed by the workers for ``lease`` seconds,
+    those of a crashed worker are picked up again after that.
+    """
+
+    def __init__(self, path, lease=300):
+        self.path = path
+        self.lease = lease
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._migrated = False
+
+    @property
+    def db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30,
+                                                  isolation_level=None)
+            db.execute('CREATE TABLE IF NOT EXISTS mail ('
+                       'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                       'message TEXT NOT NULL, '
+                       'attempts INTEGER NOT NULL DEFAULT 0, '
+                       'next_try REAL NOT NULL, '
+                       'claimed REAL, '
+                       'digest TEXT)')
+            with self._lock:
+                if not self._migrated:
+                    self._migrate(db)
+                    self._migrated = True
+        return db
+
+    def _migrate(self, db):
+        # spools created before the digests lack the column
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            columns = [row[1] for row in db.execute('PRAGMA table_info(mail)')]
+            if 'digest' not in columns:
+                db.execute('ALTER TABLE mail ADD COLUMN digest TEXT')
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    def put(self, message, not_before=None, digest=None):
+        """
+        Spool a mail, if ``digest`` is given and an unsent mail has the
+        same key, the message is merged into that mail instead.
+        """
+        db = self.db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = None
+            if digest is not None:
+                row = db.execute('SELECT id, message FROM mail '
+                                 'WHERE digest = ? AND claimed IS NULL AND attempts = 0 '
+                                 'ORDER BY id LIMIT 1', (digest, )).fetchone()
+            if row is not None:
+                merged = load_message(row[1])
+                merged['parts'].extend(message['parts'])
+                db.execute('UPDATE mail SET message = ? WHERE id = ?',
+                           (json.dumps(merged), row[0]))
+            else:
+                db.execute('INSERT INTO mail (message, next_try, digest) VALUES (?, ?, ?)',
+                           (json.dumps(message), not_before or time.time(), digest))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    def claim(self, limit):
+        now = time.time()
+        db = self.db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            rows = db.execute('SELECT id, message, attempts FROM mail '
+                              'WHERE next_try <= ? AND (claimed IS NULL OR claimed < ?) '
+                              'ORDER BY id LIMIT ?', (now, now - self.lease, limit)).fetchall()
+            db.executemany('UPDATE mail SET claimed = ? WHERE id = ?',
+                           [(now, row[0]) for row in rows])
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return [(pk, load_message(message), attempts) for pk, message, attempts in rows]
+
+    def done(self, pks):
+        self.db.executemany('DELETE FROM mail WHERE id = ?', [(pk, ) for pk in pks])
+
+    def retry(self, pk, attempts, next_try):
+        self.db.execute('UPDATE mail SET attempts = ?, next_try = ?, claimed = NULL '
+                        'WHERE id = ?', (attempts, next_try, pk))
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM mail').fetchone()[0]
+
+
+class MailQueue(object):
+    """
+    A bounded pool of ``EMAIL_WORKERS`` threads delivering the spooled
+    mails, each batch of up to ``EMAIL_BATCH_SIZE`` mails is sent over
+    one connection. Failed mails are retried with exponential backoff
+    starting from ``EMAIL_RETRY_DELAY`` seconds, and dropped after
+    ``EMAIL_MAX_ATTEMPTS`` attempts.
+    """
+
+    def __init__(self, spool_path=None):
+        self.spool_path = spool_path
+        self._spool = None
+        self._workers = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    @property
+    def spool(self):
+        if self._spool is None:
+            self._spool = MailSpool(self.spool_path or settings.EMAIL_SPOOL_PATH)
+        return self._spool
+
+    def put(self, message, not_before=None, digest=None):
+        self.spool.put(message, not_before=not_before, digest=digest)
+        self.start()
+        self._wakeup.set()
+
+    def start(self):
+        with self._lock:
+            self._workers = [w for w in self._workers if w.is_alive()]
+            while len(self._workers) < settings.EMAIL_WORKERS:
+                worker = threading.Thread(target=self._run, name='blog-mail')
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def _run(self):
+        while True:
+            try:
+                sent = self.deliver()
+            except Exception:
+                logger.exception('Failed to deliver the spooled mails')
+                sent = 0
+            if not sent:
+                self._wakeup.wait(settings.EMAIL_POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def deliver(self):
+        """
+        Send one batch, return the number of mails handled.
+        """
+        rows = self.spool.claim(settings.EMAIL_BATCH_SIZE)
+        if not rows:
+            return 0
+
+        connection = get_connection()
+        sent = []
+        try:
+            connection.open()
+            for pk, message, attempts in rows:
+                try:
+                    connection.send_messages([build_message(message)])
+                except Exception:
+                    self._failed(pk, message, attempts + 1)
+                else:
+                    sent.append(pk)
+        except Exception:
+            # the connection could not be opened, retry the whole batch
+            for pk, message, attempts in rows:
+                if pk not in sent:
+                    self._failed(pk, message, attempts + 1)
+        finally:
+            self.spool.done(sent)
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+        return len(rows)
+
+    def _failed(self, pk, message, attempts):
+        if attempts >= settings.EMAIL_MAX_ATTEMPTS:
+            if not message.get('fail_silently'):
+                logger.error('Mail to %s dropped after %s attempts',
+                             ', '.join(message['to']), attempts)
+            self.spool.done([pk])
+            return
+        delay = settings.EMAIL_RETRY_DELAY * 2 ** (attempts - 1)
+        self.spool.retry(pk, attempts, time.time() + delay)
+
+    def flush(self, timeout=None):
+        """
+        Wait until the spool is empty, for tests and shutdown.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while len(self.spool):
+            if deadline is not None and time.time() >= deadline:
+                return False
+            self._wakeup.set()
+            time.sleep(0.05)
+        return True
+
+
+def load_message(data):
+    """
+    Decode a spooled message, the flat ones spooled before the digests
+    are converted to a single part.
+    """
+    message = json.loads(data)
+    if 'parts' not in message:
+        message['parts'] = [{'subject': message.pop('subject'),
+                             'body': message.pop('body'),
+                             'html': message.pop('html', None)}]
+    return message
+
+
+def build_message(message):
+    parts = message['parts']
+    if len(parts) == 1:
+        subject, body, html = parts[0]['subject'], parts[0]['body'], parts[0]['html']
+    else:
+        # digest of several notifications
+        subject = settings.EMAIL_DIGEST_SUBJECT % len(parts)
+        body = '\n\n----------\n\n'.join(part['body'] for part in parts)
+        html = None
+        if any(part['html'] for part in parts):
+            html = '<hr />'.join(part['html'] or linebreaks(part['body'], autoescape=True)
+                                 for part in parts)
+
+    msg = EmailMultiAlternatives(subject, body, message['from_email'], message['to'])
+    if html:
+        msg.attach_alternative(html, "text/html")
+    return msg
+
+
+class ThroughputBackend(BaseEmailBackend):
+    """
+    Local stand-in backend for tests, keeps the sent messages in memory
+    and measures the delivery throughput.
+    """
+
+    outbox = []
+    connections = 0
+    started = None
+    _lock = threading.Lock()
+
+    def open(self):
+        with self._lock:
+            ThroughputBackend.connections += 1
+        return True
+
+    def send_messages(self, messages):
+        with self._lock:
+            if ThroughputBackend.started is None:
+                ThroughputBackend.started = time.time()
+            ThroughputBackend.outbox.extend(messages)
+        return len(messages)
+
+    @classmethod
+    def throughput(cls):
+        if not cls.outbox or cls.started is None:
+            return 0.0
+        elapsed = time.time() - cls.started
+        return len(cls.outbox) / elapsed if elapsed else float(len(cls.outbox))
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls.outbox = []
+            cls.connections = 0
+            cls.started = None
+
+
+mail_queue = MailQueue()
 
 
 def send_mail(subject, body, from_email, recipient_list,
-              fail_silently=False, html=None, *args, **kwargs):
-    EmailThread(subject, body, from_email, recipient_list, fail_silently, html).start()
\ No newline at end of file
+              fail_silently=False, html=None, digest=False, *args, **kwargs):
+    """
+    Spool a mail, with ``digest`` the mails to the same recipients within
+    ``EMAIL_DIGEST_WINDOW`` seconds are grouped into one message.
+    """
+    message = {
+        'parts': [{'subject': subject, 'body': body, 'html': html}],
+        'from_email': from_email,
+        'to': list(recipient_list),
+        'fail_silently': fail_silently,
+    }
+    if digest:
+        key = json.dumps([from_email] + sorted(recipient_list))
+        mail_queue.put(message, not_before=time.time() + settings.EMAIL_DIGEST_WINDOW,
+                       digest=key)
+    else:
+        mail_queue.put(message)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import io
+import os
+import re
+import time
+import random
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from whoosh.index import create_in
+from whoosh.qparser import MultifieldParser
+
+from blog.models import Article
+from blog.analysis import get_analyzer
+from blog.search import get_schema, make_document
+from blog.utils import to_text
+
+
+# runs of word characters, a chinese run is a whole phrase which
+# matches no analyzer's tokens in particular
+WORD_RE = re.compile(r'\w{2,}', re.UNICODE)
+CJK_RE = re.compile(u'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+class Command(BaseCommand):
+    help = 'Compare the index size, indexing speed and query latency ' \
+           'of the search analyzers on a chinese corpus.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', default=None,
+                            help='UTF-8 text file, one document per line. '
+                                 'The articles in the database are used by default.')
+        parser.add_argument('--queries', type=int, default=200,
+                            help='Number of queries sampled from the corpus.')
+        parser.add_argument('--query-file', default=None,
+                            help='UTF-8 text file, one query per line, '
+                                 'used instead of the sampled queries.')
+        parser.add_argument('--analyzers', default='standard,cjk',
+                            help='Comma separated analyzers to compare.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        docs = self._load_corpus(options['corpus'])
+        if not docs:
+            raise CommandError('The corpus is empty.')
+        if options['query_file'] is not None:
+            with io.open(options['query_file'], encoding='utf-8') as f:
+                queries = [line.strip() for line in f if line.strip()]
+        else:
+            queries = self._sample_queries(docs, options['queries'], options['seed'])
+
+        self.stdout.write('%s docs, %s queries' % (len(docs), len(queries)))
+        self.stdout.write('%-10s %12s %12s %14s %10s' % (
+            'analyzer', 'index size', 'docs/sec', 'query (ms)', 'hits'))
+        for name in options['analyzers'].split(','):
+            self._run(name.strip(), docs, queries)
+
+    def _load_corpus(self, path):
+        if path is not None:
+            with io.open(path, encoding='utf-8') as f:
+                return [make_document(i, u'', line, [], u'')
+                        for i, line in enumerate(f, 1) if line.strip()]
+
+        return [make_document(a.pk, a.title, a.content, [t.name for t in a.tags.all()], a.slug)
+                for a in Article.objects.only('pk', 'title', 'slug', 'content')
+                                        .prefetch_related('tags')]
+
+    def _sample_queries(self, docs, count, seed):
+        # the documents are stripped of their html by make_document, the
+        # words are not taken from any analyzer so that none is favoured
+        rnd = random.Random(seed)
+        words = []
+        for doc in docs:
+            words.extend(WORD_RE.findall(to_text(doc['content'])[:500]))
+        if not words:
+            return []
+
+        queries = []
+        for _ in range(count):
+            word = rnd.choice(words)
+            if CJK_RE.match(word) and len(word) > 4:
+                # a span of a chinese sentence, at any offset
+                size = rnd.randint(2, 4)
+                start = rnd.randint(0, len(word) - size)
+                word = word[start:start + size]
+            queries.append(word)
+        return queries
+
+    def _run(self, name, docs, queries):
+        index_dir = tempfile.mkdtemp()
+        try:
+            idx = create_in(index_dir, schema=get_schema(get_analyzer(name)))
+
+            start = time.time()
+            writer = idx.writer()
+            for doc in docs:
+                writer.add_document(**doc)
+            writer.commit()
+            index_elapsed = time.time() - start
+
+            hits = 0
+            with idx.searcher() as searcher:
+                parser = MultifieldParser(('title', 'content'), idx.schema)
+                start = time.time()
+                for q in queries:
+                    hits += len(searcher.search(parser.parse(q), limit=10))
+                query_elapsed = time.time() - start
+
+            self.stdout.write('%-10s %12s %12.1f %14.3f %10s' % (
+                name, _dir_size(index_dir), len(docs) / index_elapsed,
+                query_elapsed * 1000 / max(len(queries), 1), hits))
+        finally:
+            shutil.rmtree(index_dir)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from blog.assets import AssetBuilder, reset_manifest, rcssmin, rjsmin, brotli
+
+
+class Command(BaseCommand):
+    help = 'Concatenate, minify and fingerprint the static bundles, ' \
+           'with their gzip and brotli compressed siblings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--build-dir', default=None,
+                            help='Output directory, default to ASSET_BUILD_DIR.')
+
+    def handle(self, *args, **options):
+        for name, module in (('rcssmin', rcssmin), ('rjsmin', rjsmin), ('brotli', brotli)):
+            if module is None:
+                self.stderr.write('%s is not installed, skipped' % name)
+
+        builder = AssetBuilder(options['build_dir'] or settings.ASSET_BUILD_DIR,
+                               settings.ASSET_BUNDLES, settings.ASSET_BUILD_URL)
+        manifest = builder.build()
+        reset_manifest()
+
+        for name in sorted(settings.ASSET_BUNDLES):
+            self.stdout.write('%s -> %s' % (name, manifest[name]))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.stylesheets import SassProject, extract_critical, clear_cache, sass
+from blog.utils import to_binary, to_text
+
+
+class Command(BaseCommand):
+    help = 'Compile the sass sources of the theme whose imports changed, ' \
+           'and extract the critical css inlined by base.html.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', default=False,
+                            help='Compile every entrypoint even if it did not change.')
+        parser.add_argument('--clear', action='store_true', default=False,
+                            help='Remove the compiled outputs kept in SASS_CACHE_DIR first.')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            clear_cache(settings.SASS_CACHE_DIR)
+
+        if sass is None:
+            self.stderr.write('libsass is not installed, the css is not compiled')
+        else:
+            project = SassProject(settings.SASS_SOURCE_DIR, settings.SASS_OUTPUT_DIR,
+                                  settings.SASS_CACHE_DIR, settings.SASS_OUTPUT_STYLE)
+            try:
+                results = project.build(force=options['force'])
+            except sass.CompileError as e:
+                raise CommandError(str(e))
+            for entry, state in results:
+                self.stdout.write('%s: %s' % (os.path.relpath(entry, settings.SASS_SOURCE_DIR), state))
+
+        self._write_critical()
+
+    def _write_critical(self):
+        source = os.path.join(settings.SASS_OUTPUT_DIR, settings.SASS_CRITICAL_SOURCE)
+        if not os.path.exists(source):
+            return
+        with open(source, 'rb') as fp:
+            critical = to_binary(extract_critical(to_text(fp.read()),
+                                                  settings.SASS_CRITICAL_SELECTORS))
+
+        output = os.path.join(settings.SASS_OUTPUT_DIR, 'critical.css')
+        if os.path.exists(output):
+            with open(output, 'rb') as fp:
+                if fp.read() == critical:
+                    return
+        with open(output, 'wb') as fp:
+            fp.write(critical)
+        self.stdout.write('critical.css: %s bytes' % len(critical))
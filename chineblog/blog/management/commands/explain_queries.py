@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from blog.models import Article, Comment, Tag
+
+
+def get_querysets():
+    """
+    The queries of the hot paths, named for the report.
+    """
+    article = Article.objects.only('pk', 'category').first()
+    tag = Tag.objects.only('pk').first()
+    article_pk = article.pk if article else 0
+    category_pk = article.category_id if article else 0
+    tag_pk = tag.pk if tag else 0
+    content_type = ContentType.objects.get_for_model(Article)
+
+    return [
+        ('visible articles',
+         Article.visible_objects.all()),
+        ('index page',
+         Article.visible_objects.order_by('-on_top', '-created', 'id')[:settings.PAGE_SIZE]),
+        ('populars',
+         Article.objects.order_by('-pvs')[:5]),
+        ('category articles',
+         Article.visible_objects.filter(category_id=category_pk)[:settings.PAGE_SIZE]),
+        ('tag articles',
+         Article.visible_objects.filter(articletag__tag_id=tag_pk)[:settings.PAGE_SIZE]),
+        ('article tags',
+         Tag.objects.filter(articletag__article_id=article_pk)),
+        ('comment tree',
+         Comment.objects.filter(content_type=content_type, object_id=article_pk,
+                                visible=True).order_by('-tree_id', 'lft')),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Print the EXPLAIN plans of the queries behind the blog pages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        explain = 'EXPLAIN QUERY PLAN' if connection.vendor == 'sqlite' else 'EXPLAIN'
+
+        for name, queryset in get_querysets():
+            sql, params = queryset.query.sql_with_params()
+            self.stdout.write('== %s' % name)
+            self.stdout.write(sql % tuple(repr(p) for p in params))
+            with connection.cursor() as cursor:
+                cursor.execute('%s %s' % (explain, sql), params)
+                columns = [c[0] for c in cursor.description]
+                self.stdout.write(' | '.join(columns))
+                for row in cursor.fetchall():
+                    self.stdout.write(' | '.join(str(v) for v in row))
+            self.stdout.write('')
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from whoosh.index import create_in
+
+from blog.models import Article
+from blog.search import get_schema, make_document, index_service
+
+
+def _extract(row):
+    return make_document(*row)
+
+
+def _chunks(chunk_size):
+    # evaluated in the calling thread, the pool only gets plain tuples
+    last = 0
+    while True:
+        chunk = list(Article.visible_objects.filter(pk__gt=last).order_by('pk')
+                     .only('pk', 'title', 'slug', 'content')
+                     .prefetch_related('tags')[:chunk_size])
+        if not chunk:
+            return
+        yield [(article.pk, article.title, article.content,
+                [t.name for t in article.tags.all()], article.slug)
+               for article in chunk]
+        last = chunk[-1].pk
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search index of all the articles, ' \
+           'the new index replaces the old one once it is complete.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procs', type=int, default=multiprocessing.cpu_count(),
+                            help='Number of processes used to extract and index.')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of articles fetched in one query.')
+        parser.add_argument('--limitmb', type=int, default=128,
+                            help='Memory limit of each indexing process in MB.')
+        parser.add_argument('--index-dir', default=None,
+                            help='Index to rebuild, default to INDEX_DIR.')
+
+    def handle(self, *args, **options):
+        procs = max(options['procs'], 1)
+        chunk_size = options['chunk_size']
+        index_dir = os.path.abspath(options['index_dir'] or settings.INDEX_DIR)
+        parent = os.path.dirname(index_dir)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+
+        build_dir = tempfile.mkdtemp(prefix='.reindex-', dir=parent)
+        try:
+            count, elapsed = self._build(build_dir, procs, chunk_size, options['limitmb'])
+        except Exception:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+
+        self._swap(build_dir, index_dir)
+        index_service.reset()
+        if not connection.in_atomic_block:
+            connection.close()
+
+        rate = count / elapsed if elapsed else 0
+        self.stdout.write('Indexed %s articles in %.2fs (%.1f docs/sec)' % (count, elapsed, rate))
+
+    def _build(self, build_dir, procs, chunk_size, limitmb):
+        idx = create_in(build_dir, schema=get_schema())
+        if procs > 1:
+            writer = idx.writer(procs=procs, multisegment=True, limitmb=limitmb)
+        else:
+            writer = idx.writer(limitmb=limitmb)
+
+        pool = multiprocessing.Pool(procs)
+        start = time.time()
+        count = 0
+        try:
+            for chunk in _chunks(chunk_size):
+                for doc in pool.imap(_extract, chunk, chunksize=16):
+                    writer.add_document(**doc)
+                count += len(chunk)
+                elapsed = time.time() - start
+                self.stdout.write('%s docs, %.1f docs/sec' % (count, count / elapsed))
+            pool.close()
+        except Exception:
+            pool.terminate()
+            writer.cancel()
+            raise
+        finally:
+            pool.join()
+
+        writer.commit()
+        return count, time.time() - start
+
+    def _swap(self, build_dir, index_dir):
+        # both renames stay in the same directory, so each one is atomic
+        backup_dir = None
+        if os.path.exists(index_dir):
+            backup_dir = tempfile.mkdtemp(prefix='.index-old-', dir=os.path.dirname(index_dir))
+            os.rmdir(backup_dir)
+            os.rename(index_dir, backup_dir)
+        os.rename(build_dir, index_dir)
+        if backup_dir is not None:
+            shutil.rmtree(backup_dir, ignore_errors=True)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from django.core.management.base import BaseCommand
+
+from blog.models import Category, Tag
+from blog.counters import refresh_article_counts
+from blog.caching import invalidate_sidebar, invalidate_tag_cloud
+
+
+class Command(BaseCommand):
+    help = 'Recompute the visible article counts of all the categories and tags.'
+
+    def handle(self, *args, **options):
+        categories = list(Category.objects.values_list('pk', flat=True))
+        tags = list(Tag.objects.values_list('pk', flat=True))
+        refresh_article_counts(categories, tags)
+        invalidate_sidebar()
+        invalidate_tag_cloud()
+
+        self.stdout.write('Repaired %s categories and %s tags' % (len(categories), len(tags)))
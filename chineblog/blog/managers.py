@@ -21,27 +21,64 @@ from django.db.models import Q
 from mptt.managers import TreeManager
 
 
-class VisibleArticleManager(models.Manager):
-    def get_query_set(self):
-        return super(VisibleArticleManager, self).get_query_set().filter(status=2)
+class ArticleQuerySet(models.QuerySet):
+    # large text columns, the lists show the summary or the abstract at most
+    LISTING_DEFERRED = ('abstract_markdown', 'content_markdown', 'content')
+    SIDEBAR_DEFERRED = LISTING_DEFERRED + ('abstract', 'summary')
+
+    def for_listing(self):
+        return self.select_related('category', 'author__user') \
+            .defer(*self.LISTING_DEFERRED)
+
+    def for_sidebar(self):
+        return self.select_related('category', 'author__user') \
+            .defer(*self.SIDEBAR_DEFERRED)
+
+
+ArticleManager = models.Manager.from_queryset(ArticleQuerySet)
+
+
+class VisibleArticleManager(ArticleManager):
+    def get_queryset(self):
+        return super(VisibleArticleManager, self).get_queryset().filter(status=2)
 
 
 class CommentToArticleManager(TreeManager):
-    def get_query_set(self):
+    def get_queryset(self):
         return super(CommentToArticleManager, self) \
-            .get_query_set() \
+            .get_queryset() \
             .filter(Q(visible=True) & Q(content_type__model="article"))
 
 
 class CommentsVisibleManager(models.Manager):
-    def get_query_set(self):
+    def get_queryset(self):
         return super(CommentsVisibleManager, self) \
-            .get_query_set() \
+            .get_queryset() \
             .filter(visible=True)
 
 
 class CommentToBlogUserManager(TreeManager):
-    def get_query_set(self):
+    def get_queryset(self):
         return super(CommentToBlogUserManager, self) \
-            .get_query_set() \
+            .get_queryset() \
             .filter(Q(visible=True) & Q(content_type__model="bloguser"))
+
+
+def build_comment_tree(comments):
+    """
+    Nest comments ordered by ``tree_id`` and ``lft``, the replies of each
+    comment are set to its ``replies``. Replies to comments which are not
+    in ``comments``, e.g. invisible ones, are dropped with their subtree.
+    """
+    roots, nodes = [], {}
+    for comment in comments:
+        comment.replies = []
+        parent_id = comment.reply_to_comment_id
+        if parent_id is None:
+            roots.append(comment)
+        elif parent_id in nodes:
+            nodes[parent_id].replies.append(comment)
+        else:
+            continue
+        nodes[comment.pk] = comment
+    return roots
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import hashlib
+import threading
+import multiprocessing
+
+import bleach
+import markdown
+from django.conf import settings
+
+from .caching import LRUCache
+from .utils import to_text, to_binary, strip_html
+
+
+_local = threading.local()
+_rendered = None
+
+
+def get_rendered_cache():
+    global _rendered
+    if _rendered is None:
+        _rendered = LRUCache(max_bytes=settings.MARKDOWN_CACHE_MAX_BYTES)
+    return _rendered
+
+
+def source_hash(text):
+    return hashlib.sha1(to_binary(text)).hexdigest()
+
+
+def _get_converter(extensions):
+    # Markdown instances are not thread-safe, keep one per thread
+    converters = _local.__dict__.setdefault('converters', {})
+    md = converters.get(extensions)
+    if md is None:
+        md = converters[extensions] = markdown.Markdown(extensions=list(extensions))
+    return md
+
+
+def render_markdown(text, extensions=()):
+    text = to_text(text)
+    extensions = tuple(extensions)
+
+    rendered = get_rendered_cache()
+    key = ('markdown', extensions, source_hash(text))
+    html = rendered.get(key)
+    if html is None:
+        html = _get_converter(extensions).reset().convert(text)
+        rendered.set(key, html)
+    return html
+
+
+def render_comment(text):
+    text = to_text(text)
+
+    rendered = get_rendered_cache()
+    key = ('comment', source_hash(text))
+    html = rendered.get(key)
+    if html is None:
+        raw = strip_html(text, remove=False)
+        html = bleach.linkify(render_markdown(raw, ('fenced_code', )))
+        rendered.set(key, html)
+    return html
+
+
+def _render_task(text, extensions):
+    # runs in the worker processes, exceptions are returned since
+    # python 2 pools have no error callback
+    try:
+        return True, render_markdown(text, extensions)
+    except Exception as e:
+        return False, repr(e)
+
+
+class RenderPool(object):
+    """
+    Renders markdown in a pool of worker processes, ``callback`` is
+    called with ``(ok, html)`` in a thread of the current process.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(settings.ASYNC_RENDER_WORKERS)
+            return self._pool
+
+    def submit(self, text, extensions, callback):
+        return self.pool.apply_async(_render_task, (to_text(text), tuple(extensions)),
+                                     callback=callback)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+
+render_pool = RenderPool()
+
+
+def should_render_async(text):
+    threshold = settings.ASYNC_RENDER_THRESHOLD
+    return threshold is not None and len(text) >= threshold
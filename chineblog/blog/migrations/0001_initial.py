@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import blog.utils
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django_markdown.models
+import filebrowser.fields
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='分类名')),
+                ('slug', models.SlugField()),
+                ('order', models.IntegerField(blank=True, null=True, verbose_name='顺序')),
+            ],
+            options={
+                'ordering': ['order'],
+                'verbose_name': '分类',
+                'verbose_name_plural': '分类',
+            },
+        ),
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='标签名')),
+                ('slug', models.SlugField()),
+            ],
+            options={
+                'ordering': ['?'],
+                'verbose_name': '标签',
+                'verbose_name_plural': '标签',
+            },
+        ),
+        migrations.CreateModel(
+            name='BlogUser',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('small_avatar', filebrowser.fields.FileBrowseField(blank=True, max_length=40, null=True, verbose_name='头像（42×42）')),
+                ('info_markdown', django_markdown.models.MarkdownField(blank=True, null=True, verbose_name='用户信息（markdown）')),
+                ('info', models.TextField(editable=False, null=True, verbose_name='用户信息')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': '用户',
+                'verbose_name_plural': '用户',
+            },
+        ),
+        migrations.CreateModel(
+            name='Link',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, verbose_name='链接名')),
+                ('site', models.URLField(verbose_name='链接地址')),
+            ],
+            options={
+                'verbose_name': '友情链接',
+                'verbose_name_plural': '友情链接',
+            },
+        ),
+        migrations.CreateModel(
+            name='Article',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=100, verbose_name='标题')),
+                ('slug', models.SlugField(max_length=100)),
+                ('abstract_markdown', django_markdown.models.MarkdownField(blank=True, null=True, verbose_name='摘要（markdown）')),
+                ('abstract', models.TextField(editable=False, null=True, verbose_name='摘要')),
+                ('content_markdown', django_markdown.models.MarkdownField(verbose_name='内容（markdown）')),
+                ('content', models.TextField(editable=False, verbose_name='内容')),
+                ('status', models.IntegerField(choices=[(1, '编辑'), (2, '完成'), (3, '失效')], default=1, verbose_name='状态')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('modified', models.DateTimeField(default=blog.utils.tz_now, verbose_name='修改时间')),
+                ('on_top', models.BooleanField(default=False, verbose_name='置顶')),
+                ('pvs', models.IntegerField(default=0, editable=False, verbose_name='pv数')),
+                ('uvs', models.IntegerField(default=0, editable=False, verbose_name='uv数')),
+                ('likes', models.IntegerField(default=0, editable=False, verbose_name='赞的个数')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='blog.BlogUser', verbose_name='作者')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='blog.Category', verbose_name='分类')),
+            ],
+            options={
+                'ordering': ['-on_top', '-created'],
+                'verbose_name': '文章',
+                'verbose_name_plural': '文章',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArticleTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='blog.Article')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='blog.Tag')),
+            ],
+            options={
+                'verbose_name': '文章标签',
+                'verbose_name_plural': '文章标签',
+            },
+        ),
+        migrations.CreateModel(
+            name='Comment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=50, verbose_name='用户名')),
+                ('email_address', models.EmailField(max_length=254, verbose_name='邮箱地址')),
+                ('site', models.URLField(blank=True, verbose_name='站点')),
+                ('avatar', models.URLField(blank=True, null=True, verbose_name='头像')),
+                ('content_markdown', django_markdown.models.MarkdownField(verbose_name='内容（markdown）')),
+                ('content', models.TextField(editable=False, verbose_name='内容')),
+                ('post_date', models.DateTimeField(default=blog.utils.tz_now, editable=False, verbose_name='评论时间')),
+                ('visible', models.BooleanField(default=True, verbose_name='是否可见')),
+                ('ip', models.GenericIPAddressField(blank=True, null=True, verbose_name='IP地址')),
+                ('object_id', models.PositiveIntegerField()),
+                ('lft', models.PositiveIntegerField(db_index=True, editable=False)),
+                ('rght', models.PositiveIntegerField(db_index=True, editable=False)),
+                ('tree_id', models.PositiveIntegerField(db_index=True, editable=False)),
+                ('level', models.PositiveIntegerField(db_index=True, editable=False)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+                ('reply_to_comment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='blog.Comment')),
+            ],
+            options={
+                'ordering': ['-post_date'],
+                'verbose_name': '评论',
+                'verbose_name_plural': '评论',
+            },
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='tags',
+            field=models.ManyToManyField(through='blog.ArticleTag', to='blog.Tag', verbose_name='标签'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='articles',
+            field=models.ManyToManyField(through='blog.ArticleTag', to='blog.Article', verbose_name='文章'),
+        ),
+    ]
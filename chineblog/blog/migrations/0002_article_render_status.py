@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='render_status',
+            field=models.IntegerField(choices=[(0, '已渲染'), (1, '渲染中'), (2, '渲染失败')], default=0, editable=False, verbose_name='渲染状态'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0002_article_render_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='article',
+            name='pvs',
+            field=models.IntegerField(db_index=True, default=0, editable=False, verbose_name='pv数'),
+        ),
+        migrations.AlterIndexTogether(
+            name='article',
+            index_together=set([('status', 'on_top', 'created'), ('category', 'status', 'on_top', 'created')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='articletag',
+            index_together=set([('tag', 'article')]),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_article_counts(apps, schema_editor):
+    Article = apps.get_model('blog', 'Article')
+    Category = apps.get_model('blog', 'Category')
+    Tag = apps.get_model('blog', 'Tag')
+
+    for model, field in ((Category, 'category'), (Tag, 'articletag__tag')):
+        rows = Article.objects.filter(status=2).order_by().values(field) \
+            .annotate(count=Count('pk', distinct=True))
+        for row in rows:
+            model.objects.filter(pk=row[field]).update(article_count=row['count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_tag_ordering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='article_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='文章数'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='article_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='文章数'),
+        ),
+        migrations.RunPython(fill_article_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from blog.utils import get_summary
+
+
+def fill_summaries(apps, schema_editor):
+    Article = apps.get_model('blog', 'Article')
+    BlogUser = apps.get_model('blog', 'BlogUser')
+
+    for model, source in ((Article, 'content'), (BlogUser, 'info')):
+        rows = model.objects.exclude(**{source: None}).values_list('pk', source)
+        for pk, text in rows.iterator():
+            model.objects.filter(pk=pk).update(summary=get_summary(text))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_article_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='summary',
+            field=models.TextField(editable=False, null=True, verbose_name='内容摘要'),
+        ),
+        migrations.AddField(
+            model_name='bloguser',
+            name='summary',
+            field=models.TextField(editable=False, null=True, verbose_name='用户信息摘要'),
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
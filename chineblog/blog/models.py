@@ -17,12 +17,10 @@ limitations under the License.
 """
 from __future__ import unicode_literals
 
-import re
+import logging
 
-import markdown
-import bleach
 from django.db import models
-from django.db import transaction
+from django.db import transaction, connection
 from django.contrib.contenttypes import fields
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.admin import User
@@ -33,15 +31,69 @@ from mptt.models import MPTTModel
 from mptt.managers import TreeManager
 from filebrowser.fields import FileBrowseField
 
-from .managers import VisibleArticleManager, CommentsVisibleManager, \
-    CommentToArticleManager, CommentToBlogUserManager
-from .utils import tz_now, get_summary, to_text, to_binary, strip_html
+from .managers import ArticleManager, VisibleArticleManager, CommentsVisibleManager, \
+    CommentToArticleManager, CommentToBlogUserManager, build_comment_tree
+from .caching import cached, COMMENT_TREE_KEY
+from .counters import article_counters, article_visitors, session_filter
+from .avatars import AVATAR_ATTR_RE, avatar_url, resolve_avatars
+from .markup import render_markdown, render_comment, render_pool, \
+    should_render_async
+from .utils import tz_now, get_summary, to_binary
+
+
+logger = logging.getLogger(__name__)
+
+class TrackedFieldsMixin(object):
+    """
+    Remembers the values of ``tracked_fields`` as loaded from the database,
+    so that ``save`` and the signals can skip the work of the fields which
+    did not change. Only references are kept, values are not copied.
+    """
+
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(TrackedFieldsMixin, cls).from_db(db, field_names, values)
+        instance.reset_tracked_fields()
+        return instance
+
+    def reset_tracked_fields(self):
+        self.__dict__['_loaded_values'] = dict(
+            (f, self.__dict__[f]) for f in self.tracked_fields if f in self.__dict__)
+
+    def has_changed(self, field):
+        loaded = self.__dict__.get('_loaded_values')
+        if loaded is None:
+            # not saved yet
+            return True
+        if field not in self.__dict__:
+            # deferred and never accessed
+            return False
+        return field not in loaded or loaded[field] != self.__dict__[field]
+
+    def loaded_value(self, field, default=None):
+        return self.__dict__.get('_loaded_values', {}).get(field, default)
+
+    def changed_fields(self, update_fields=None):
+        """
+        Attribute names of the fields written by the ongoing save which
+        differ from the loaded ones, meant for the ``post_save`` receivers.
+        All the concrete fields count as changed for an unsaved instance.
+        """
+        if update_fields is not None:
+            return set(self._meta.get_field(f).attname for f in update_fields)
+        if self.__dict__.get('_loaded_values') is None:
+            return set(f.attname for f in self._meta.concrete_fields)
+        return set(f for f in self.tracked_fields if self.has_changed(f))
 
 
 class Category(models.Model):
     name = models.CharField(max_length=50, unique=True, verbose_name='分类名')
     slug = models.SlugField()
     order = models.IntegerField(null=True, blank=True, verbose_name='顺序')
+    # 可见文章数，由 counters.refresh_article_counts 维护
+    article_count = models.IntegerField(default=0, editable=False, verbose_name='文章数')
 
     class Meta:
         verbose_name = "分类"
@@ -70,13 +122,14 @@ class Category(models.Model):
 class Tag(models.Model):
     name = models.CharField(max_length=50, unique=True, verbose_name='标签名')
     slug = models.SlugField()
+    # 可见文章数，由 counters.refresh_article_counts 维护
+    article_count = models.IntegerField(default=0, editable=False, verbose_name='文章数')
 
     articles = models.ManyToManyField("Article", through="ArticleTag", verbose_name='文章')
 
     class Meta:
         verbose_name = "标签"
         verbose_name_plural = "标签"
-        ordering = ['?']
 
     def __unicode__(self):
         return self.name
@@ -85,12 +138,18 @@ class Tag(models.Model):
         return reverse('blog_tag', args=(self.slug, ))
 
 
-class Article(models.Model):
+class Article(TrackedFieldsMixin, models.Model):
     STATUS_CHOICE = (
         (1, '编辑'),
         (2, '完成'),
         (3, '失效'),
     )
+    RENDER_CURRENT, RENDER_PENDING, RENDER_FAILED = range(3)
+    RENDER_STATUS_CHOICE = (
+        (RENDER_CURRENT, '已渲染'),
+        (RENDER_PENDING, '渲染中'),
+        (RENDER_FAILED, '渲染失败'),
+    )
 
     title = models.CharField(max_length=100, verbose_name='标题')
     slug = models.SlugField(max_length=100)
@@ -98,13 +157,17 @@ class Article(models.Model):
     abstract = models.TextField(verbose_name='摘要', null=True, editable=False)
     content_markdown = MarkdownField(verbose_name='内容（markdown）')
     content = models.TextField(verbose_name='内容', editable=False)
+    # 分页符之前的内容，列表页不必读取全文
+    summary = models.TextField(verbose_name='内容摘要', null=True, editable=False)
     status = models.IntegerField(choices=STATUS_CHOICE, default=1, verbose_name='状态')
     created = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     modified = models.DateTimeField(default=tz_now, verbose_name='修改时间')
     on_top = models.BooleanField(default=False, verbose_name='置顶')
+    render_status = models.IntegerField(choices=RENDER_STATUS_CHOICE, default=RENDER_CURRENT,
+                                        editable=False, verbose_name='渲染状态')
 
     # 统计相关
-    pvs = models.IntegerField(default=0, editable=False, verbose_name='pv数')
+    pvs = models.IntegerField(default=0, editable=False, db_index=True, verbose_name='pv数')
     uvs = models.IntegerField(default=0, editable=False, verbose_name='uv数')
     likes = models.IntegerField(default=0, editable=False, verbose_name='赞的个数')
 
@@ -114,41 +177,53 @@ class Article(models.Model):
     comments = fields.GenericRelation('Comment')
 
     # Managers
-    objects = models.Manager()
+    objects = ArticleManager()
     visible_objects = VisibleArticleManager()
 
+    # fields of the search documents, and of the pages showing articles
+    SEARCH_FIELDS = frozenset(['title', 'slug', 'content'])
+    DISPLAY_FIELDS = SEARCH_FIELDS | frozenset([
+        'abstract', 'summary', 'status', 'created', 'modified', 'on_top',
+        'render_status', 'category_id', 'author_id'])
+
+    tracked_fields = ('abstract_markdown', 'content_markdown') + tuple(sorted(DISPLAY_FIELDS))
+
     class Meta:
         verbose_name = "文章"
         verbose_name_plural = "文章"
         ordering = ['-on_top', '-created']
+        # the visible listing, of the index and of a category
+        index_together = [
+            ('status', 'on_top', 'created'),
+            ('category', 'status', 'on_top', 'created'),
+        ]
 
     def on_click(self, session):
-        self.pvs += 1
-        if session.get('reads', None) is None:
-            self.uvs += 1
-            session['reads'] = [self.pk, ]
-        else:
-            reads = set(session.get('reads', []))
-            if self.pk not in reads:
-                self.uvs += 1
-                reads.add(self.pk)
-                session['reads'] = list(reads)
-        super(Article, self).save()
+        # counters are written back in batches by ``article_counters``
+        deltas = {'pvs': 1}
+        reads = session_filter(session, 'reads')
+        if reads.add(self.pk):
+            # the session is only written when a new article is read
+            deltas['uvs'] = 1
+            session['reads'] = reads.dumps()
+
+        visitor = getattr(session, 'session_key', None)
+        if visitor:
+            article_visitors.add(self.pk, visitor)
+
+        self.pvs += deltas['pvs']
+        self.uvs += deltas.get('uvs', 0)
+        article_counters.add(self.pk, **deltas)
 
     def on_like(self, session):
-        if session.get('likes', None) is None:
-            self.likes += 1
-            session['likes'] = [self.pk, ]
-            return True
-        else:
-            likes = set(session.get('likes', []))
-            if self.pk not in likes:
-                self.likes += 1
-                likes.add(self.pk)
-                session['likes'] = list(likes)
-                return True
+        likes = session_filter(session, 'likes')
+        if not likes.add(self.pk):
+            return False
+        session['likes'] = likes.dumps()
 
-        return False
+        self.likes += 1
+        article_counters.add(self.pk, likes=1)
+        return True
 
     def __unicode__(self):
         return self.title
@@ -157,36 +232,91 @@ class Article(models.Model):
         return reverse('blog_article', args=(self.slug, ))
 
     @property
-    def summary(self):
-        return get_summary(self.content)
+    def estimated_uvs(self):
+        return article_visitors.count(self.pk)
 
     @property
     def visible_comments(self):
         return self.comments.filter(visible=True)
 
+    @property
+    def comment_tree(self):
+        return get_comment_tree(self)
+
     def save(self, *args, **kwargs):
-        if self.abstract_markdown:
-            self.abstract = to_binary(markdown.markdown(to_text(self.abstract_markdown)))
-        if self.content_markdown:
-            self.content = to_binary(markdown.markdown(to_text(self.content_markdown),
-                                                       extensions=['fenced_code']))
+        if self.has_changed('abstract_markdown') and self.abstract_markdown:
+            self.abstract = to_binary(render_markdown(self.abstract_markdown))
+        render_later = False
+        if self.has_changed('content_markdown') and self.content_markdown:
+            if should_render_async(self.content_markdown):
+                # large posts are rendered by the workers after the save
+                self.render_status = self.RENDER_PENDING
+                render_later = True
+            else:
+                self.content = to_binary(render_markdown(self.content_markdown,
+                                                         extensions=['fenced_code']))
+                self.render_status = self.RENDER_CURRENT
+        if self.has_changed('content'):
+            self.summary = get_summary(self.content)
 
         super(Article, self).save(*args, **kwargs)
+        self.reset_tracked_fields()
 
+        if render_later:
+            pk, source = self.pk, self.content_markdown
+            transaction.on_commit(lambda: render_pool.submit(
+                source, ['fenced_code'], lambda result: _content_rendered(pk, source, result)))
 
-class ArticleTag(models.Model):
+    @property
+    def is_rendered(self):
+        return self.render_status == self.RENDER_CURRENT
+
+
+def _content_rendered(pk, source, result):
+    # called in the result handler thread of the render pool, which would
+    # die on an exception and leave every later article pending
+    try:
+        ok, html = result
+        article = Article.objects.get(pk=pk)
+        if article.content_markdown != source:
+            # edited meanwhile, the later save scheduled its own rendering
+            return
+        if ok:
+            article.content = to_binary(html)
+            article.render_status = Article.RENDER_CURRENT
+        else:
+            article.render_status = Article.RENDER_FAILED
+        article.save(update_fields=['content', 'summary', 'render_status'])
+    except Article.DoesNotExist:
+        pass
+    except Exception:
+        logger.exception('Failed to save the rendered content of article %s', pk)
+    finally:
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+class ArticleTag(TrackedFieldsMixin, models.Model):
     article = models.ForeignKey(Article)
     tag = models.ForeignKey(Tag)
 
+    tracked_fields = ('tag_id', )
+
     class Meta:
         verbose_name = "文章标签"
         verbose_name_plural = "文章标签"
+        # articles of a tag, without going back to the table
+        index_together = [('tag', 'article'), ]
 
     def __unicode__(self):
         return unicode(self.tag)
 
+    def save(self, *args, **kwargs):
+        super(ArticleTag, self).save(*args, **kwargs)
+        self.reset_tracked_fields()
+
 
-class Comment(MPTTModel):
+class Comment(TrackedFieldsMixin, MPTTModel):
     username = models.CharField(max_length=50, verbose_name='用户名')
     email_address = models.EmailField(verbose_name='邮箱地址')
     site = models.URLField(blank=True, verbose_name='站点')
@@ -211,6 +341,8 @@ class Comment(MPTTModel):
     to_blog_user_objects = CommentToBlogUserManager()
     visible_objects = CommentsVisibleManager()
 
+    tracked_fields = ('content_markdown', )
+
     class Meta:
         ordering = ['-post_date']
         verbose_name = '评论'
@@ -224,36 +356,56 @@ class Comment(MPTTModel):
         return self.email_address == settings.ADMINS[0][1]
 
     def __getattr__(self, name):
-        # avatar
-        avatar_reg = re.compile("^avatar_([0-9]+)$")
-        if avatar_reg.match(name):
-            if self.avatar.startswith('http://www.gravatar.com/'):
-                size = avatar_reg.match(name).group(0)
-                return self.avatar.split('?')[0] + "?s=" + str(size) + "&d=404"
-            else:
-                return self.avatar
+        # only reached when the attribute is missing, e.g. avatar_42
+        if name.startswith('avatar_'):
+            match = AVATAR_ATTR_RE.match(name)
+            if match:
+                url = avatar_url(self.avatar, int(match.group(1)))
+                self.__dict__[name] = url
+                return url
 
-        return super(Comment, self).__getattr__(name)
+        raise AttributeError("'%s' object has no attribute '%s'" % (
+            self.__class__.__name__, name))
 
     def __unicode__(self):
         return self.content
 
     def save(self, *args, **kwargs):
-        if self.content_markdown:
-            raw = strip_html(to_text(self.content_markdown), remove=False)
-            content = markdown.markdown(raw, extensions=['fenced_code'])
-            self.content = to_binary(bleach.linkify(content))
+        if self.has_changed('content_markdown') and self.content_markdown:
+            self.content = to_binary(render_comment(self.content_markdown))
 
         super(Comment, self).save(*args, **kwargs)
+        self.reset_tracked_fields()
 
 
-class BlogUser(models.Model):
+def get_comment_tree(obj):
+    """
+    Visible comments to ``obj`` loaded in one query and nested by
+    :func:`build_comment_tree`, the threads are ordered from the newest.
+    Cached until a comment to ``obj`` is saved or deleted.
+    """
+    content_type = ContentType.objects.get_for_model(obj)
+
+    def load():
+        comments = Comment.objects.filter(
+            content_type=content_type, object_id=obj.pk, visible=True
+        ).order_by('-tree_id', 'lft')
+        return resolve_avatars(build_comment_tree(comments))
+
+    return cached(COMMENT_TREE_KEY % (content_type.pk, obj.pk), load,
+                  timeout=settings.COMMENT_TREE_CACHE_TIMEOUT)
+
+
+class BlogUser(TrackedFieldsMixin, models.Model):
     small_avatar = FileBrowseField(max_length=40, verbose_name='头像（42×42）', null=True, blank=True)
     info_markdown = MarkdownField(verbose_name='用户信息（markdown）', null=True, blank=True)
     info = models.TextField(verbose_name='用户信息', editable=False, null=True)
+    summary = models.TextField(verbose_name='用户信息摘要', editable=False, null=True)
 
     user = models.OneToOneField(User)
 
+    tracked_fields = ('info_markdown', )
+
     class Meta:
         verbose_name = '用户'
         verbose_name_plural = '用户'
@@ -262,14 +414,16 @@ class BlogUser(models.Model):
         return self.user.username
 
     @property
-    def summary(self):
-        return get_summary(self.info)
+    def comment_tree(self):
+        return get_comment_tree(self)
 
     def save(self, *args, **kwargs):
-        if self.info_markdown:
-            self.info = to_binary(markdown.markdown(to_text(self.info_markdown)))
+        if self.has_changed('info_markdown') and self.info_markdown:
+            self.info = to_binary(render_markdown(self.info_markdown))
+            self.summary = get_summary(self.info)
 
         super(BlogUser, self).save(*args, **kwargs)
+        self.reset_tracked_fields()
 
 
 class Link(models.Model):
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import bisect
+import calendar
+
+from django.conf import settings
+from django.core import signing
+from django.core.paginator import Page, EmptyPage, PageNotAnInteger
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .caching import cached, PAGINATION_KEY
+
+
+def _timestamp(dt):
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1e6
+
+
+class KeysetPaginator(object):
+    """
+    Paginator seeking on ``(-on_top, -created, id)`` instead of using
+    ``OFFSET``, so a deep page costs the same as the first one.
+
+    The keys of the first article of each page and the total count are
+    computed in one pass and cached under ``cache_key`` until an article
+    is saved or deleted, numbered pages are then looked up from them.
+    Pages can also be fetched from an opaque cursor token.
+    """
+
+    fields = ('on_top', 'created', 'id')
+    ordering = ('-on_top', '-created', 'id')
+    salt = 'blog.pagination'
+
+    def __init__(self, object_list, per_page, cache_key):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.cache_key = PAGINATION_KEY % cache_key
+        self._boundaries = None
+
+    @staticmethod
+    def sort_key(row):
+        # ascending tuple in the same order as ``ordering``
+        on_top, created, pk = row
+        return not on_top, -_timestamp(created), pk
+
+    def _load_boundaries(self):
+        rows = self.object_list.order_by(*self.ordering).values_list(*self.fields)
+        count = 0
+        boundaries = []
+        for row in rows.iterator():
+            if count % self.per_page == 0:
+                boundaries.append(tuple(row))
+            count += 1
+        return count, boundaries
+
+    @property
+    def boundaries(self):
+        if self._boundaries is None:
+            self._boundaries = cached(self.cache_key, self._load_boundaries,
+                                      timeout=settings.PAGINATION_CACHE_TIMEOUT)
+        return self._boundaries
+
+    @property
+    def count(self):
+        return self.boundaries[0]
+
+    @property
+    def num_pages(self):
+        return max(len(self.boundaries[1]), 1)
+
+    @property
+    def page_range(self):
+        return range(1, self.num_pages + 1)
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        if number > self.num_pages:
+            if number == 1:
+                return number
+            raise EmptyPage('That page contains no results')
+        return number
+
+    def _seek(self, key, inclusive=True):
+        on_top, created, pk = key
+        pk_q = Q(id__gte=pk) if inclusive else Q(id__gt=pk)
+        return self.object_list.filter(
+            Q(on_top__lt=on_top) |
+            Q(on_top=on_top, created__lt=created) |
+            (Q(on_top=on_top, created=created) & pk_q)
+        ).order_by(*self.ordering)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        boundaries = self.boundaries[1]
+        if not boundaries:
+            return KeysetPage([], number, self)
+        objects = list(self._seek(boundaries[number - 1])[:self.per_page])
+        return KeysetPage(objects, number, self)
+
+    def page_after(self, cursor):
+        """
+        The page following the article encoded in ``cursor``.
+        """
+        key = self.decode_cursor(cursor)
+        objects = list(self._seek(key, inclusive=False)[:self.per_page])
+        if not objects:
+            raise EmptyPage('That page contains no results')
+        # number of the page the first article falls in
+        sort_keys = [self.sort_key(b) for b in self.boundaries[1]]
+        number = bisect.bisect_right(sort_keys, self.sort_key(self.key_of(objects[0])))
+        return KeysetPage(objects, max(number, 1), self)
+
+    def key_of(self, obj):
+        return tuple(getattr(obj, f) for f in self.fields)
+
+    def encode_cursor(self, obj):
+        on_top, created, pk = self.key_of(obj)
+        return signing.dumps([on_top, created.isoformat(), pk], salt=self.salt)
+
+    def decode_cursor(self, cursor):
+        try:
+            on_top, created, pk = signing.loads(cursor, salt=self.salt)
+            created = parse_datetime(created)
+        except (signing.BadSignature, TypeError, ValueError):
+            raise EmptyPage('Invalid cursor')
+        if created is None:
+            raise EmptyPage('Invalid cursor')
+        return bool(on_top), created, int(pk)
+
+
+class KeysetPage(Page):
+    @property
+    def next_cursor(self):
+        if self.object_list and self.has_next():
+            return self.paginator.encode_cursor(self.object_list[-1])
+
+    def start_index(self):
+        if self.paginator.count == 0:
+            return 0
+        return (self.number - 1) * self.paginator.per_page + 1
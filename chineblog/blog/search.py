@@ -16,30 +16,279 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import os
+import time
+import logging
+import atexit
+import threading
 
 from django.conf import settings
-from whoosh.index import create_in, open_dir, exists_in
+from django.utils.html import escape
+from django.utils.six.moves import queue
+from whoosh.index import create_in, open_dir, exists_in, LockError
 from whoosh.fields import Schema, TEXT, NUMERIC, KEYWORD, STORED
+from whoosh.qparser import MultifieldParser
 
+from .caching import LRUCache
+from .analysis import get_analyzer
 from .utils import to_text, strip_html
 
 
-def index_article(article, index_dir=None):
+logger = logging.getLogger(__name__)
+
+
+def get_schema(analyzer=None):
+    analyzer = analyzer or get_analyzer()
+    # content is stored for the highlights of search results
+    return Schema(title=TEXT(stored=True, analyzer=analyzer),
+                  content=TEXT(stored=True, analyzer=analyzer),
+                  id=NUMERIC(stored=True, unique=True), tags=KEYWORD,
+                  slug=STORED)
+
+
+def get_index(index_dir=None):
     index_dir = index_dir or settings.INDEX_DIR
     if not exists_in(index_dir):
-        schema = Schema(title=TEXT(stored=True), content=TEXT,
-                        id=NUMERIC(stored=True, unique=True), tags=KEYWORD,
-                        slug=STORED)
         if not os.path.exists(index_dir):
             os.makedirs(index_dir)
-        idx = create_in(index_dir, schema=schema)
-    else:
-        idx = open_dir(index_dir)
+        return create_in(index_dir, schema=get_schema())
+    return open_dir(index_dir)
+
 
+def make_document(pk, title, content, tags, slug):
+    return dict(title=to_text(title),
+                content=strip_html(to_text(content)),
+                id=pk,
+                tags=[to_text(t) for t in tags],
+                slug=to_text(slug))
+
+
+def article_document(article):
+    return make_document(article.pk, article.title, article.content,
+                         [t.name for t in article.tags.all()], article.slug)
+
+
+def index_article(article, index_dir=None):
+    idx = get_index(index_dir)
     writer = idx.writer()
-    writer.update_document(title=to_text(article.title),
-                           content=strip_html(to_text(article.content)),
-                           id=article.pk,
-                           tags=[to_text(t.name) for t in article.tags.all()],
-                           slug=to_text(article.slug))
-    writer.commit()
\ No newline at end of file
+    writer.update_document(**article_document(article))
+    writer.commit()
+
+
+class IndexService(object):
+    """
+    Keeps the index open and applies the document updates queued by the
+    signals on a background thread, committing them in batches.
+
+    A batch is committed once ``SEARCH_BATCH_SIZE`` documents are queued
+    or ``SEARCH_COMMIT_INTERVAL`` seconds have passed, the segments are
+    merged into one every ``SEARCH_OPTIMIZE_EVERY`` commits.
+    """
+
+    _stop = object()
+
+    def __init__(self, index_dir=None):
+        self.index_dir = index_dir
+        self.commits = 0
+
+        self._index = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = get_index(self.index_dir)
+        return self._index
+
+    def reset(self):
+        self._index = None
+
+    def update(self, article):
+        # only the visible articles are searchable
+        if article.status != 2:
+            self.delete(article.pk)
+            return
+        if not settings.SEARCH_ASYNC_INDEX:
+            index_article(article, self.index_dir)
+            return
+        # the document is built here since the article may change later
+        self._put(('update', article_document(article)))
+
+    def delete(self, pk):
+        if not settings.SEARCH_ASYNC_INDEX:
+            writer = self.index.writer()
+            writer.delete_by_term('id', pk)
+            writer.commit()
+            return
+        self._put(('delete', pk))
+
+    def _put(self, op):
+        self._ensure_worker()
+        self._queue.put(op)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='blog-index')
+                self._worker.daemon = True
+                self._worker.start()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        stopped = False
+
+        while not stopped:
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+            try:
+                op = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                op = None
+            else:
+                if op is self._stop:
+                    stopped = True
+                else:
+                    batch.append(op)
+                    if deadline is None:
+                        deadline = time.time() + settings.SEARCH_COMMIT_INTERVAL
+
+            # checked after every item, a steady stream of updates never
+            # lets get() time out
+            if batch and (stopped or op is None or
+                          len(batch) >= settings.SEARCH_BATCH_SIZE or
+                          time.time() >= deadline):
+                try:
+                    self._commit(batch)
+                except LockError:
+                    # someone else, e.g. the reindex command, holds the writer
+                    if not stopped:
+                        deadline = time.time() + settings.SEARCH_COMMIT_INTERVAL
+                        continue
+                    logger.error('Index is locked, %s updates dropped', len(batch))
+                except Exception:
+                    logger.exception('Failed to commit %s index updates', len(batch))
+
+                for _ in range(len(batch)):
+                    self._queue.task_done()
+                batch = []
+                deadline = None
+
+        self._queue.task_done()
+
+    def _commit(self, batch):
+        writer = self.index.writer(timeout=settings.SEARCH_COMMIT_INTERVAL)
+        try:
+            for action, arg in batch:
+                if action == 'update':
+                    writer.update_document(**arg)
+                else:
+                    writer.delete_by_term('id', arg)
+        except Exception:
+            writer.cancel()
+            raise
+
+        self.commits += 1
+        if self.commits % settings.SEARCH_OPTIMIZE_EVERY == 0:
+            writer.commit(optimize=True)
+        else:
+            writer.commit(merge=False)
+
+    def flush(self):
+        """
+        Block until all the queued updates are committed.
+        """
+        if self._worker is not None and self._worker.is_alive():
+            self._queue.join()
+
+    def stop(self):
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None and worker.is_alive():
+            self._queue.put(self._stop)
+            worker.join()
+
+
+class SearchService(object):
+    """
+    Runs queries against long-lived searchers, one per thread, which are
+    refreshed at most every ``SEARCH_REFRESH_INTERVAL`` seconds when the
+    index changed. Result pages are kept in an LRU keyed by the index
+    generation, the normalized query and the page.
+    """
+
+    fields = ('title', 'content', 'tags')
+    field_boosts = {'title': 2.0, 'tags': 1.5}
+
+    def __init__(self, index_dir=None):
+        self.index_dir = index_dir
+
+        self._local = threading.local()
+        self._results = None
+
+    @property
+    def results(self):
+        if self._results is None:
+            self._results = LRUCache(max_entries=settings.SEARCH_CACHE_SIZE)
+        return self._results
+
+    def searcher(self):
+        local = self._local
+        now = time.time()
+        if getattr(local, 'searcher', None) is None:
+            idx = get_index(self.index_dir)
+            local.searcher = idx.searcher()
+            local.generation = idx.latest_generation()
+            local.checked = now
+        elif now - local.checked >= settings.SEARCH_REFRESH_INTERVAL:
+            local.checked = now
+            if not local.searcher.up_to_date():
+                local.searcher = local.searcher.refresh()
+                local.generation = get_index(self.index_dir).latest_generation()
+        return local.searcher
+
+    def close(self):
+        searcher = getattr(self._local, 'searcher', None)
+        if searcher is not None:
+            searcher.close()
+            self._local.searcher = None
+
+    @staticmethod
+    def normalize(query):
+        return ' '.join(to_text(query).split())
+
+    def search(self, query, page=1, pagelen=None):
+        query = self.normalize(query)
+        pagelen = pagelen or settings.SEARCH_PAGE_SIZE
+        searcher = self.searcher()
+
+        key = (self._local.generation, query, page, pagelen)
+        results = self.results.get(key)
+        if results is None:
+            results = self._search(searcher, query, page, pagelen)
+            self.results.set(key, results)
+        return results
+
+    def _search(self, searcher, query, page, pagelen):
+        parser = MultifieldParser(self.fields, searcher.schema,
+                                  fieldboosts=self.field_boosts)
+        hits = searcher.search_page(parser.parse(query), page, pagelen=pagelen)
+        return {
+            'query': query,
+            'total': len(hits),
+            'page': hits.pagenum,
+            'pagecount': hits.pagecount,
+            'hits': [{
+                'id': hit['id'],
+                'title': hit['title'],
+                'slug': hit.get('slug'),
+                # the highlights are escaped by the formatter, the title is not
+                'title_highlight': hit.highlights('title') or escape(hit['title']),
+                'highlight': hit.highlights('content'),
+            } for hit in hits],
+        }
+
+
+index_service = IndexService()
+search_service = SearchService()
+atexit.register(index_service.stop)
@@ -19,19 +19,157 @@ limitations under the License.
 import os
 
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.conf import settings
 from django.template import loader, Context
 
-from .models import Article, Comment
+from .models import Article, ArticleTag, Tag, Comment, Category, Link, BlogUser
 from .mail import send_mail
 from .utils import strip_html, to_str
-from .search import index_article as _index_article
+from .search import index_service
+from .counters import refresh_article_counts
+from .caching import invalidate_sidebar, invalidate_populars, \
+    invalidate_comment_tree, invalidate_pagination, invalidate_tag_cloud, page_cache, \
+    bump_watermark
+
+
+def _changed(instance, update_fields, fields):
+    # post_save runs before ``save`` resets the tracked fields
+    return not instance.changed_fields(update_fields).isdisjoint(fields)
 
 
 @receiver(post_save, sender=Article, dispatch_uid='index_article')
-def index_article(sender, instance, **_):
-    _index_article(instance)
+def index_article(sender, instance, update_fields=None, **_):
+    # the articles leaving the visible status are removed from the index
+    if _changed(instance, update_fields, Article.SEARCH_FIELDS | frozenset(['status'])):
+        index_service.update(instance)
+
+
+@receiver([post_save, post_delete], sender=ArticleTag, dispatch_uid='index_article_tag')
+def index_article_tags(sender, instance, **_):
+    try:
+        article = instance.article
+    except Article.DoesNotExist:
+        # deleted along with its article
+        return
+    index_service.update(article)
+
+
+@receiver(post_delete, sender=Article, dispatch_uid='unindex_article')
+def unindex_article(sender, instance, **_):
+    index_service.delete(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Category, dispatch_uid='sidebar_category')
+@receiver([post_save, post_delete], sender=Link, dispatch_uid='sidebar_link')
+@receiver([post_save, post_delete], sender=BlogUser, dispatch_uid='sidebar_blog_user')
+def invalidate_sidebar_cache(sender, **_):
+    invalidate_sidebar()
+
+
+@receiver(post_save, sender=Article, dispatch_uid='sidebar_article')
+def invalidate_populars_cache(sender, instance, update_fields=None, **_):
+    if _changed(instance, update_fields, Article.DISPLAY_FIELDS):
+        invalidate_populars()
+
+
+@receiver(post_delete, sender=Article, dispatch_uid='sidebar_article_delete')
+def invalidate_populars_cache_on_delete(sender, **_):
+    invalidate_populars()
+
+
+# the changes of the visible articles refresh the counts, which
+# invalidates the cloud once they are up to date
+@receiver([post_save, post_delete], sender=Tag, dispatch_uid='tag_cloud_tag')
+def invalidate_tag_cloud_cache(sender, **_):
+    invalidate_tag_cloud()
+
+
+@receiver(post_save, sender=Article, dispatch_uid='article_counts_save')
+def update_article_counts(sender, instance, update_fields=None, **_):
+    # the loaded values are still those of the former row
+    changed = instance.changed_fields(update_fields)
+    if 'status' not in changed and 'category_id' not in changed:
+        return
+    categories = (instance.category_id, instance.loaded_value('category_id'))
+    tags = ()
+    if 'status' in changed:
+        tags = ArticleTag.objects.filter(article_id=instance.pk) \
+            .values_list('tag_id', flat=True)
+    refresh_article_counts(categories, tags)
+
+
+@receiver(post_delete, sender=Article, dispatch_uid='article_counts_delete')
+def update_category_article_count(sender, instance, **_):
+    # the tags are handled by the deletions of the cascaded ArticleTag
+    refresh_article_counts(category_pks=(instance.category_id, ))
+
+
+@receiver([post_save, post_delete], sender=ArticleTag, dispatch_uid='article_counts_tag')
+def update_tag_article_count(sender, instance, **_):
+    refresh_article_counts(tag_pks=(instance.tag_id, instance.loaded_value('tag_id')))
+
+
+@receiver(post_save, sender=Article, dispatch_uid='pagination_article')
+def invalidate_pagination_cache(sender, instance, update_fields=None, **_):
+    # the boundaries only depend on the visible articles and their order
+    if _changed(instance, update_fields, ('status', 'on_top', 'created')):
+        invalidate_pagination('index')
+
+
+@receiver(post_delete, sender=Article, dispatch_uid='pagination_article_delete')
+def invalidate_pagination_cache_on_delete(sender, **_):
+    invalidate_pagination('index')
+
+
+@receiver(post_save, sender=Article, dispatch_uid='page_article')
+def invalidate_article_pages(sender, instance, update_fields=None, **_):
+    if _changed(instance, update_fields, Article.DISPLAY_FIELDS):
+        page_cache.invalidate(sender._meta.model_name)
+
+
+@receiver(post_delete, sender=Article, dispatch_uid='page_article_delete')
+@receiver([post_save, post_delete], sender=Category, dispatch_uid='page_category')
+@receiver([post_save, post_delete], sender=Link, dispatch_uid='page_link')
+@receiver([post_save, post_delete], sender=BlogUser, dispatch_uid='page_blog_user')
+@receiver([post_save, post_delete], sender=Comment, dispatch_uid='page_comment')
+@receiver([post_save, post_delete], sender=Tag, dispatch_uid='page_tag')
+@receiver([post_save, post_delete], sender=ArticleTag, dispatch_uid='page_article_tag')
+def invalidate_page_cache(sender, **_):
+    page_cache.invalidate(sender._meta.model_name)
+
+
+@receiver(post_save, sender=Article, dispatch_uid='watermark_article')
+def bump_watermark_on_article(sender, instance, update_fields=None, **_):
+    if _changed(instance, update_fields, Article.DISPLAY_FIELDS):
+        bump_watermark()
+
+
+@receiver(post_delete, sender=Article, dispatch_uid='watermark_article_delete')
+@receiver([post_save, post_delete], sender=Comment, dispatch_uid='watermark_comment')
+@receiver([post_save, post_delete], sender=Category, dispatch_uid='watermark_category')
+@receiver([post_save, post_delete], sender=Tag, dispatch_uid='watermark_tag')
+@receiver([post_save, post_delete], sender=ArticleTag, dispatch_uid='watermark_article_tag')
+@receiver([post_save, post_delete], sender=Link, dispatch_uid='watermark_link')
+@receiver([post_save, post_delete], sender=BlogUser, dispatch_uid='watermark_blog_user')
+def bump_watermark_on_change(sender, **_):
+    bump_watermark()
+
+
+@receiver([post_save, post_delete], sender=Comment, dispatch_uid='comment_tree')
+def invalidate_comment_tree_cache(sender, instance, **_):
+    invalidate_comment_tree(instance.content_type_id, instance.object_id)
+
+
+_templates = {}
+
+
+def _get_template(name):
+    # compiled once and reused by every notification
+    template = _templates.get(name)
+    if template is None:
+        template = _templates[name] = loader.get_template(name)
+    return template
 
 
 @receiver(post_save, sender=Comment, dispatch_uid='send_email')
@@ -39,7 +177,7 @@ def send_email(sender, instance, **_):
     comment = instance
 
     if settings.ENABLE_EMAIL and comment.visible:
-        template = loader.get_template('blog/phantom/email.html')
+        template = _get_template('blog/phantom/email.html')
         typo = 0 if comment.content_type.model == 'article' else 1
         ctx = Context({
             'type': typo,
@@ -51,15 +189,16 @@ def send_email(sender, instance, **_):
 
         if not comment.reply_to_comment:
             to_email = [settings.ADMINS[0][1], ]
-            if type == 0:
+            if typo == 0:
                 subject = '【残阳似血的博客】上的文章刚刚被%s评论了' % comment.username
             else:
                 subject = '【残阳似血的博客】刚刚收到%s的留言' % comment.username
         else:
             to_email = [comment.reply_to_comment.email_address, ]
-            if type == 0:
+            if typo == 0:
                 subject = u'您在【残阳似血的博客】上的评论刚刚被%s回复了' % comment.username
             else:
                 subject = u'您在【残阳似血的博客】上的留言刚刚被%s回复了' % comment.username
         from_email = settings.EMAIL_HOST_USER
-        send_mail(subject, plain_text, from_email, to_email, html=html)
\ No newline at end of file
+        send_mail(subject, plain_text, from_email, to_email, html=html,
+                  digest=settings.EMAIL_DIGEST_WINDOW > 0)
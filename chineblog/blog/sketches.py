@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import math
+import base64
+import hashlib
+import struct
+
+from .utils import to_binary, to_text
+
+
+def _hash64(value):
+    digest = hashlib.md5(to_binary(value)).digest()
+    return struct.unpack('<QQ', digest)
+
+
+class BloomFilter(object):
+    """
+    Fixed-size bloom filter, serialized as a short base64 string
+    so that it can live in the session.
+    """
+
+    def __init__(self, bits=2048, hashes=4, data=None):
+        self.bits = bits
+        self.hashes = hashes
+        if data is None:
+            self.data = bytearray((bits + 7) // 8)
+        else:
+            self.data = bytearray(data)
+
+    def _positions(self, key):
+        h1, h2 = _hash64(key)
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def __contains__(self, key):
+        return all(self.data[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(key))
+
+    def add(self, key):
+        """
+        Add the key, return True if it was not in the filter yet.
+        """
+        added = False
+        for pos in self._positions(key):
+            mask = 1 << (pos & 7)
+            if not self.data[pos >> 3] & mask:
+                self.data[pos >> 3] |= mask
+                added = True
+        return added
+
+    def dumps(self):
+        return to_text(base64.b64encode(bytes(self.data)))
+
+    @classmethod
+    def loads(cls, s, bits=2048, hashes=4):
+        data = base64.b64decode(to_binary(s))
+        if len(data) != (bits + 7) // 8:
+            # size changed in the settings, start over
+            return cls(bits=bits, hashes=hashes)
+        return cls(bits=bits, hashes=hashes, data=data)
+
+
+class HyperLogLog(object):
+    """
+    HyperLogLog cardinality estimator with ``2 ** precision`` registers.
+    """
+
+    def __init__(self, precision=10, data=None):
+        self.precision = precision
+        self.m = 1 << precision
+        if data is None:
+            self.registers = bytearray(self.m)
+        else:
+            self.registers = bytearray(data)
+
+    @property
+    def alpha(self):
+        if self.m == 16:
+            return 0.673
+        elif self.m == 32:
+            return 0.697
+        elif self.m == 64:
+            return 0.709
+        return 0.7213 / (1 + 1.079 / self.m)
+
+    def add(self, value):
+        """
+        Add the value, return True if any register changed.
+        """
+        x = _hash64(value)[0]
+        idx = x & (self.m - 1)
+        w = x >> self.precision
+        rank = 1
+        max_rank = 64 - self.precision + 1
+        while rank < max_rank and not w & 1:
+            w >>= 1
+            rank += 1
+
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+            return True
+        return False
+
+    def count(self):
+        estimate = self.alpha * self.m * self.m / \
+            sum(2.0 ** -r for r in self.registers)
+        if estimate <= 2.5 * self.m:
+            zeros = self.registers.count(0)
+            if zeros:
+                estimate = self.m * math.log(float(self.m) / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        for i, r in enumerate(other.registers):
+            if r > self.registers[i]:
+                self.registers[i] = r
+
+    def dumps(self):
+        return to_text(base64.b64encode(bytes(self.registers)))
+
+    @classmethod
+    def loads(cls, s, precision=10):
+        data = base64.b64decode(to_binary(s))
+        if len(data) != 1 << precision:
+            return cls(precision=precision)
+        return cls(precision=precision, data=data)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+
+from .utils import to_binary, to_text
+
+try:
+    import sass
+except ImportError:
+    sass = None
+
+
+COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+LINE_COMMENT_RE = re.compile(r'(^|\s)//[^\n]*')
+IMPORT_RE = re.compile(r'@import\s+([^;]+);')
+STRING_RE = re.compile(r'''(['"])(.+?)\1''')
+SIMPLE_SELECTOR_RE = re.compile(r'\*|[#.]?-?[\w-]+')
+
+
+def _read(path):
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+
+def _write(path, content):
+    dirname = os.path.dirname(path)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    fd, tmp = tempfile.mkstemp(dir=dirname)
+    with os.fdopen(fd, 'wb') as fp:
+        fp.write(content)
+    os.chmod(tmp, 0o644)
+    os.rename(tmp, path)
+
+
+class SassProject(object):
+    """
+    Sass sources of a theme compiled with libsass.
+
+    The ``@import`` of the sources are parsed into a dependency graph,
+    an entrypoint (a source not starting with ``_``) is only compiled
+    again when the hash of itself and all the partials it imports
+    changed. Compiled outputs are kept in ``cache_dir`` by that hash,
+    so going back to a former state of the sources costs nothing.
+    """
+
+    def __init__(self, source_dir, output_dir, cache_dir, output_style='expanded'):
+        self.source_dir = source_dir
+        self.output_dir = output_dir
+        self.cache_dir = cache_dir
+        self.output_style = output_style
+
+        self._imports = {}
+
+    def entrypoints(self):
+        entries = []
+        for root, _, files in os.walk(self.source_dir):
+            for name in files:
+                if name.endswith('.scss') and not name.startswith('_'):
+                    entries.append(os.path.join(root, name))
+        return sorted(entries)
+
+    def resolve(self, name, from_dir):
+        if name.endswith('.css') or name.startswith(('http://', 'https://', '//', 'url(')):
+            # plain css imports are left to the browser
+            return
+        dirname, basename = os.path.split(name)
+        if not basename.endswith('.scss'):
+            basename += '.scss'
+        for base in (from_dir, self.source_dir):
+            for candidate in ('_' + basename, basename):
+                path = os.path.normpath(os.path.join(base, dirname, candidate))
+                if os.path.isfile(path):
+                    return path
+
+    def imports(self, path):
+        mtime = os.path.getmtime(path)
+        entry = self._imports.get(path)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+        source = to_text(_read(path))
+        source = LINE_COMMENT_RE.sub(r'\1', COMMENT_RE.sub('', source))
+        deps = []
+        for match in IMPORT_RE.finditer(source):
+            for _, name in STRING_RE.findall(match.group(1)):
+                dep = self.resolve(name, os.path.dirname(path))
+                if dep is not None:
+                    deps.append(dep)
+        self._imports[path] = mtime, deps
+        return deps
+
+    def closure(self, path):
+        seen, stack = set(), [path]
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            stack.extend(self.imports(current))
+        return seen
+
+    def digest(self, path):
+        sha = hashlib.sha1(to_binary(self.output_style))
+        for dep in sorted(self.closure(path)):
+            sha.update(to_binary(os.path.relpath(dep, self.source_dir)))
+            sha.update(_read(dep))
+        return sha.hexdigest()
+
+    def output_path(self, entry):
+        name = os.path.splitext(os.path.relpath(entry, self.source_dir))[0]
+        return os.path.join(self.output_dir, name + '.css')
+
+    def compile(self, entry):
+        if sass is None:
+            raise RuntimeError('libsass is not installed')
+        css = sass.compile(filename=entry, output_style=self.output_style,
+                           include_paths=[self.source_dir])
+        return to_binary(css)
+
+    def build(self, force=False):
+        """
+        Build the entrypoints, return a list of ``(entry, state)`` where
+        state is ``compiled``, ``cached`` or ``unchanged``.
+        """
+        results = []
+        for entry in self.entrypoints():
+            output = self.output_path(entry)
+            name = os.path.relpath(output, self.output_dir)
+            cached = os.path.join(self.cache_dir, '%s.%s' % (name, self.digest(entry)))
+
+            if not force and os.path.exists(cached):
+                content = _read(cached)
+                if os.path.exists(output) and _read(output) == content:
+                    results.append((entry, 'unchanged'))
+                    continue
+                _write(output, content)
+                results.append((entry, 'cached'))
+                continue
+
+            content = self.compile(entry)
+            _write(cached, content)
+            _write(output, content)
+            results.append((entry, 'compiled'))
+        return results
+
+
+def _blocks(css):
+    # top level ``(prelude, body)`` of a stylesheet, body is None for statements
+    start = depth = 0
+    prelude = body_start = quote = None
+    for i, ch in enumerate(css):
+        if quote is not None:
+            if ch == quote:
+                quote = None
+        elif ch in '\'"':
+            quote = ch
+        elif ch == '{':
+            if depth == 0:
+                prelude, body_start = css[start:i], i + 1
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                yield prelude.strip(), css[body_start:i]
+                start = i + 1
+        elif ch == ';' and depth == 0:
+            yield css[start:i].strip(), None
+            start = i + 1
+
+
+def _is_critical(selector, selectors):
+    first = re.split(r'[\s>+~]+', selector.strip(), 1)[0]
+    match = SIMPLE_SELECTOR_RE.match(first)
+    return match is not None and match.group(0) in selectors
+
+
+def extract_critical(css, selectors):
+    """
+    Keep the rules of ``css`` whose selectors start with one of
+    ``selectors``, e.g. ``#header`` keeps ``#header .links a``.
+    Media queries are kept around the rules they contain, the other
+    at-rules are left to the full stylesheet.
+    """
+    selectors = set(selectors)
+    rules = []
+    for prelude, body in _blocks(COMMENT_RE.sub('', css)):
+        if body is None:
+            continue
+        if prelude.startswith('@media'):
+            inner = extract_critical(body, selectors)
+            if inner:
+                rules.append('%s{%s}' % (prelude, inner))
+        elif not prelude.startswith('@'):
+            kept = [s.strip() for s in prelude.split(',') if _is_critical(s, selectors)]
+            if kept:
+                rules.append('%s{%s}' % (','.join(kept), re.sub(r'\s+', ' ', body.strip())))
+    return '\n'.join(rules)
+
+
+def clear_cache(cache_dir):
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import random
+
+from django.conf import settings
+
+from .caching import cached, TAG_CLOUD_KEY
+from .models import Tag
+
+
+def font_size(count, min_count, max_count):
+    if max_count == min_count:
+        return settings.MAX_FONT_SIZE
+    return settings.MIN_FONT_SIZE + int(round(
+        float(settings.MINUS_FONT_SIZE) * (count - min_count) / (max_count - min_count)))
+
+
+def _build_tag_cloud():
+    tags = list(Tag.objects.filter(article_count__gt=0)
+                .order_by('name')
+                .values('id', 'name', 'slug', 'article_count'))
+    for tag in tags:
+        tag['count'] = tag.pop('article_count')
+    if tags:
+        counts = [tag['count'] for tag in tags]
+        min_count, max_count = min(counts), max(counts)
+        for tag in tags:
+            tag['font_size'] = font_size(tag['count'], min_count, max_count)
+    return tags
+
+
+def get_tag_cloud(shuffle=False):
+    """
+    Tags with their visible article counts and font sizes, read from
+    the maintained ``article_count`` and cached until tags or articles
+    change.
+    """
+    tags = cached(TAG_CLOUD_KEY, _build_tag_cloud,
+                  timeout=settings.TAG_CLOUD_CACHE_TIMEOUT)
+    if shuffle:
+        tags = list(tags)
+        random.shuffle(tags)
+    return tags
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+
+from django import template
+from django.contrib.staticfiles import finders
+from django.utils.safestring import mark_safe
+
+from ..assets import asset_url
+from ..utils import to_text
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def asset(name):
+    """
+    URL of the static file ``name``, the fingerprinted one once
+    ``manage.py build_assets`` has been run.
+    """
+    return asset_url(name)
+
+
+_inlined = {}
+
+
+@register.simple_tag
+def inline_css(name):
+    """
+    Content of the static stylesheet ``name`` to be put in a ``<style>``,
+    empty if it does not exist. Read again only when the file changes.
+    """
+    path = finders.find(name)
+    if path is None:
+        return ''
+    mtime = os.path.getmtime(path)
+    entry = _inlined.get(path)
+    if entry is None or entry[0] != mtime:
+        with open(path, 'rb') as fp:
+            entry = _inlined[path] = mtime, mark_safe(to_text(fp.read()))
+    return entry[1]
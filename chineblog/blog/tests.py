@@ -16,17 +16,41 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import os
+import json
+import sqlite3
 import tempfile
 import shutil
-
-from django.test import TestCase
-from django.contrib.auth.models import User
+import unittest
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils.six import StringIO
+from django.test import TestCase, RequestFactory, override_settings
+from django.contrib.auth.models import User, AnonymousUser
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.core.paginator import EmptyPage
 from django.contrib.contenttypes.models import ContentType
 from whoosh.index import open_dir
 from whoosh.qparser import QueryParser
 
-from .models import Category, Article, BlogUser, Comment
-from .search import index_article
+from .models import Category, Tag, Article, ArticleTag, BlogUser, Comment, \
+    _content_rendered
+from .markup import _render_task
+from .search import index_article, IndexService, SearchService
+from .mail import MailQueue, ThroughputBackend
+from .counters import article_counters
+from .analysis import ChineseAnalyzer
+from .caching import sidebar_stats, page_stats, page_cache, LRUCache, \
+    cache_page_response, PAGE_GENERATION_KEY, SIDEBAR_KEY, TAG_CLOUD_KEY
+from .views import _basic_response, serve_asset
+from .assets import asset_url, reset_manifest
+from .stylesheets import SassProject, extract_critical, sass
+from .conditional import conditional_page
+from .pagination import KeysetPaginator
+from .tagcloud import get_tag_cloud
 from .utils import to_text
 
 
@@ -70,6 +94,118 @@ class ArticleModelTestCase(TestCase):
 
         self.assertIsNone(article2.abstract)
 
+    def test_article_markdown_render_skipped(self):
+        article = Article.objects.create(
+            title='test1', slug='test1',
+            content_markdown='#title\n* content1\n* content2',
+            author=self.blog_user, category=self.cate1
+        )
+
+        article = Article.objects.get(pk=article.pk)
+        Article.objects.filter(pk=article.pk).update(content='<p>cached</p>')
+        article.content = '<p>cached</p>'
+        article.title = 'test2'
+        article.save()
+        self.assertEqual(article.content, '<p>cached</p>')
+
+        article.content_markdown = 'content3'
+        article.save()
+        self.assertEqual(article.content, '<p>content3</p>')
+
+    def test_article_summary(self):
+        article = Article.objects.create(
+            title='test1', slug='test1',
+            content_markdown='summary\n\n<p><!-- pagebreak --></p>\n\nrest',
+            author=self.blog_user, category=self.cate1
+        )
+        self.assertEqual(article.summary, '<p>summary</p>\n')
+
+        article = Article.objects.defer('content', 'content_markdown').get(pk=article.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(article.summary, '<p>summary</p>\n')
+
+    def test_article_listing_querysets(self):
+        for i, status in enumerate((1, 2, 2)):
+            Article.objects.create(
+                title='test%s' % i, slug='test%s' % i, content_markdown='content',
+                author=self.blog_user, category=self.cate1, status=status
+            )
+
+        with self.assertNumQueries(1):
+            articles = list(Article.visible_objects.for_listing())
+            self.assertEqual(len(articles), 2)
+            for article in articles:
+                self.assertEqual(article.category.name, 'cate1')
+                self.assertEqual(article.author.user.username, 'abc')
+        self.assertTrue(set(['content', 'content_markdown']) <= articles[0].get_deferred_fields())
+
+        article = Article.objects.for_sidebar().get(slug='test0')
+        self.assertIn('summary', article.get_deferred_fields())
+
+    def test_article_changed_fields(self):
+        article = Article.objects.create(
+            title='test1', slug='test1', content_markdown='content',
+            author=self.blog_user, category=self.cate1
+        )
+        article = Article.objects.get(pk=article.pk)
+        self.assertEqual(article.changed_fields(), set())
+
+        article.pvs += 1
+        self.assertEqual(article.changed_fields(), set())
+        self.assertEqual(article.changed_fields(['pvs']), set(['pvs']))
+
+        generation = cache.get(PAGE_GENERATION_KEY % 'article')
+        article.save(update_fields=['pvs'])
+        self.assertEqual(cache.get(PAGE_GENERATION_KEY % 'article'), generation)
+
+        article.title = 'test2'
+        self.assertEqual(article.changed_fields(), set(['title']))
+        article.save()
+        self.assertNotEqual(cache.get(PAGE_GENERATION_KEY % 'article'), generation)
+        self.assertEqual(article.changed_fields(), set())
+
+    @override_settings(ASYNC_RENDER_THRESHOLD=10)
+    def test_article_async_render(self):
+        article = Article.objects.create(
+            title='test1', slug='test1',
+            content_markdown='#title\n* content1\n* content2',
+            author=self.blog_user, category=self.cate1
+        )
+        self.assertFalse(article.is_rendered)
+        self.assertEqual(article.render_status, Article.RENDER_PENDING)
+
+        article.content_markdown = 'short'
+        article.save()
+        self.assertTrue(article.is_rendered)
+        self.assertEqual(article.content, '<p>short</p>')
+
+    @override_settings(ASYNC_RENDER_THRESHOLD=10)
+    def test_article_content_rendered(self):
+        # on_commit never runs in a TestCase, the callback is called here
+        source = '#title\n* content1\n* content2'
+        article = Article.objects.create(
+            title='test1', slug='test1', content_markdown=source,
+            author=self.blog_user, category=self.cate1
+        )
+
+        # the source was edited since, the result is dropped
+        _content_rendered(article.pk, 'former', _render_task('former', ('fenced_code', )))
+        self.assertEqual(Article.objects.get(pk=article.pk).render_status,
+                         Article.RENDER_PENDING)
+
+        _content_rendered(article.pk, source, (False, None))
+        self.assertEqual(Article.objects.get(pk=article.pk).render_status,
+                         Article.RENDER_FAILED)
+
+        _content_rendered(article.pk, source, _render_task(source, ('fenced_code', )))
+        article = Article.objects.get(pk=article.pk)
+        self.assertTrue(article.is_rendered)
+        self.assertIn('<li>content1</li>', article.content)
+
+        # errors are logged, the result handler of the pool keeps running
+        _content_rendered(article.pk, source, None)
+        _content_rendered(article.pk + 1, source, (True, ''))
+
     def test_article_click_and_like(self):
         article = Article.objects.create(
             title='test1', slug='test1',
@@ -93,6 +229,44 @@ class ArticleModelTestCase(TestCase):
         self.assertFalse(article.on_like(sess))
         self.assertEqual(article.likes, 1)
 
+    def test_article_click_session_size(self):
+        sess = self.client.session
+        articles = [
+            Article.objects.create(
+                title='test%s' % i, slug='test%s' % i,
+                content_markdown='content', author=self.blog_user, category=self.cate1
+            ) for i in range(20)
+        ]
+
+        articles[0].on_click(sess)
+        size = len(sess['reads'])
+        for article in articles:
+            article.on_click(sess)
+        self.assertEqual(len(sess['reads']), size)
+        self.assertEqual(articles[0].uvs, 1)
+        self.assertEqual(articles[0].pvs, 2)
+
+    def test_article_counters_flush(self):
+        article = Article.objects.create(
+            title='test1', slug='test1',
+            content_markdown='#title\n* content1\n* content2',
+            author=self.blog_user, category=self.cate1
+        )
+
+        article_counters.flush()  # drop deltas left by other tests
+        sess = self.client.session
+        for _ in range(3):
+            article.on_click(sess)
+        article.on_like(sess)
+
+        self.assertEqual(Article.objects.get(pk=article.pk).pvs, 0)
+
+        article_counters.flush()
+        article = Article.objects.get(pk=article.pk)
+        self.assertEqual(article.pvs, 3)
+        self.assertEqual(article.uvs, 1)
+        self.assertEqual(article.likes, 1)
+
     def test_article_index(self):
         index_dir = tempfile.mkdtemp()
 
@@ -116,6 +290,255 @@ class ArticleModelTestCase(TestCase):
         finally:
             shutil.rmtree(index_dir)
 
+    def test_chinese_analyzer(self):
+        analyzer = ChineseAnalyzer()
+        tokens = [t.text for t in analyzer(to_text('中文分词 Hello 的'))]
+        self.assertEqual(tokens, [to_text(t) for t in ('中文', '文分', '分词', 'hello', '的')])
+
+    def test_article_index_service(self):
+        index_dir = tempfile.mkdtemp()
+        service = IndexService(index_dir)
+
+        try:
+            article = Article.objects.create(
+                title='test1', slug='test1',
+                content_markdown='#title\n* content1\n* 中文',
+                author=self.blog_user, category=self.cate1
+            )
+
+            service.update(article)
+            service.flush()
+
+            idx = open_dir(index_dir)
+            qp = QueryParser('content', idx.schema)
+            with idx.searcher() as searcher:
+                # drafts are not indexed
+                self.assertEqual(len(searcher.search(qp.parse(to_text('content1')))), 0)
+
+            article.status = 2
+            service.update(article)
+            service.flush()
+            with idx.searcher() as searcher:
+                self.assertEqual(len(searcher.search(qp.parse(to_text('content1')))), 1)
+
+            service.delete(article.pk)
+            service.flush()
+            with idx.searcher() as searcher:
+                self.assertEqual(len(searcher.search(qp.parse(to_text('content1')))), 0)
+        finally:
+            service.stop()
+            shutil.rmtree(index_dir)
+
+    def test_search_service(self):
+        index_dir = tempfile.mkdtemp()
+        service = SearchService(index_dir)
+
+        try:
+            article = Article.objects.create(
+                title='test1', slug='test1',
+                content_markdown='#title\n* content1\n* content2',
+                author=self.blog_user, category=self.cate1
+            )
+            index_article(article, index_dir)
+
+            results = service.search('  content1 ')
+            self.assertEqual(results['total'], 1)
+            self.assertEqual(results['hits'][0]['id'], article.pk)
+            self.assertIn('content1', results['hits'][0]['highlight'])
+
+            self.assertIs(service.search('content1'), results)
+            self.assertEqual(service.search('nothing')['total'], 0)
+        finally:
+            service.close()
+            shutil.rmtree(index_dir)
+
+    def test_search_drafts(self):
+        index_dir = tempfile.mkdtemp()
+        index = IndexService(index_dir)
+        service = SearchService(index_dir)
+
+        try:
+            article = Article.objects.create(
+                title='<b>test1</b>', slug='test1', content_markdown='content1',
+                author=self.blog_user, category=self.cate1, status=2
+            )
+            draft = Article.objects.create(
+                title='test2', slug='test2', content_markdown='content1 draft',
+                author=self.blog_user, category=self.cate1
+            )
+            for a in (article, draft):
+                index.update(a)
+            index.flush()
+
+            results = service.search('content1')
+            self.assertEqual([hit['id'] for hit in results['hits']], [article.pk])
+            # the stored title is escaped when it has no highlight
+            self.assertEqual(results['hits'][0]['title_highlight'], '&lt;b&gt;test1&lt;/b&gt;')
+
+            article.status = 3
+            index.update(article)
+            index.flush()
+            service.close()
+            self.assertEqual(service.search('content1')['total'], 0)
+        finally:
+            index.stop()
+            service.close()
+            shutil.rmtree(index_dir)
+
+    def test_explain_queries_command(self):
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        self.assertIn('== populars', out.getvalue())
+
+    def test_reindex_command(self):
+        index_dir = tempfile.mkdtemp()
+
+        try:
+            for i in range(4):
+                Article.objects.create(
+                    title='test%s' % i, slug='test%s' % i,
+                    content_markdown='#title\n* content%s' % i,
+                    author=self.blog_user, category=self.cate1,
+                    # the last one is a draft
+                    status=2 if i < 3 else 1
+                )
+
+            out = StringIO()
+            call_command('reindex', index_dir=index_dir, procs=1, chunk_size=2,
+                         stdout=out)
+            self.assertIn('Indexed 3 articles', out.getvalue())
+
+            idx = open_dir(index_dir)
+            with idx.searcher() as searcher:
+                self.assertEqual(searcher.doc_count(), 3)
+        finally:
+            shutil.rmtree(index_dir)
+
+
+class KeysetPaginatorTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        blog_user = BlogUser.objects.create(
+            user=User.objects.create_user(username='abc', password='abc'),
+        )
+        cate1 = Category.objects.create(name='cate1', slug='cate1')
+        self.articles = [
+            Article.objects.create(
+                title='test%s' % i, slug='test%s' % i, content_markdown='content',
+                author=blog_user, category=cate1, status=2, on_top=(i == 3)
+            ) for i in range(7)
+        ]
+
+    def test_pages(self):
+        p = KeysetPaginator(Article.objects.all(), 3, 'test')
+        self.assertEqual(p.count, 7)
+        self.assertEqual(p.num_pages, 3)
+
+        expected = list(Article.objects.order_by('-on_top', '-created', 'id'))
+        pages = [p.page(i).object_list for i in p.page_range]
+        self.assertEqual(sum(pages, []), expected)
+        self.assertFalse(p.page(3).has_next())
+
+        page2 = p.page_after(p.page(1).next_cursor)
+        self.assertEqual(page2.number, 2)
+        self.assertEqual(page2.object_list, pages[1])
+
+        self.assertRaises(EmptyPage, p.page, 4)
+        self.assertRaises(EmptyPage, p.page_after, 'invalid')
+
+
+class TagCloudTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        blog_user = BlogUser.objects.create(
+            user=User.objects.create_user(username='abc', password='abc'),
+        )
+        cate1 = Category.objects.create(name='cate1', slug='cate1')
+        self.tags = [Tag.objects.create(name='tag%s' % i, slug='tag%s' % i) for i in range(3)]
+        for i in range(3):
+            article = Article.objects.create(
+                title='test%s' % i, slug='test%s' % i, content_markdown='content',
+                author=blog_user, category=cate1, status=2
+            )
+            for tag in self.tags[:i + 1]:
+                ArticleTag.objects.create(article=article, tag=tag)
+
+    def test_tag_cloud(self):
+        cloud = get_tag_cloud()
+        self.assertEqual([t['count'] for t in cloud], [3, 2, 1])
+        self.assertEqual(cloud[0]['font_size'], settings.MAX_FONT_SIZE)
+        self.assertEqual(cloud[2]['font_size'], settings.MIN_FONT_SIZE)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_tag_cloud(shuffle=True)), 3)
+
+        Tag.objects.create(name='tag3', slug='tag3')
+        ArticleTag.objects.create(article=Article.objects.first(), tag=Tag.objects.get(name='tag3'))
+        self.assertEqual(len(get_tag_cloud()), 4)
+
+
+class ArticleCountTestCase(TestCase):
+    def setUp(self):
+        self.blog_user = BlogUser.objects.create(
+            user=User.objects.create_user(username='abc', password='abc'),
+        )
+        self.cate1 = Category.objects.create(name='cate1', slug='cate1')
+        self.cate2 = Category.objects.create(name='cate2', slug='cate2')
+        self.tag = Tag.objects.create(name='tag1', slug='tag1')
+
+    def _counts(self):
+        return [Category.objects.get(pk=self.cate1.pk).article_count,
+                Category.objects.get(pk=self.cate2.pk).article_count,
+                Tag.objects.get(pk=self.tag.pk).article_count]
+
+    def test_article_counts(self):
+        article = Article.objects.create(
+            title='test1', slug='test1', content_markdown='content',
+            author=self.blog_user, category=self.cate1
+        )
+        ArticleTag.objects.create(article=article, tag=self.tag)
+        self.assertEqual(self._counts(), [0, 0, 0])
+
+        article.status = 2
+        article.save()
+        self.assertEqual(self._counts(), [1, 0, 1])
+
+        article = Article.objects.get(pk=article.pk)
+        article.category = self.cate2
+        article.save()
+        self.assertEqual(self._counts(), [0, 1, 1])
+
+        article.delete()
+        self.assertEqual(self._counts(), [0, 0, 0])
+
+    def test_repair_counters(self):
+        Article.objects.create(
+            title='test1', slug='test1', content_markdown='content',
+            author=self.blog_user, category=self.cate1, status=2
+        )
+        Category.objects.update(article_count=10)
+
+        out = StringIO()
+        call_command('repair_counters', stdout=out)
+        self.assertEqual(self._counts(), [1, 0, 0])
+
+    def test_article_counts_invalidate_sidebar(self):
+        article = Article.objects.create(
+            title='test1', slug='test1', content_markdown='content',
+            author=self.blog_user, category=self.cate1
+        )
+        ArticleTag.objects.create(article=article, tag=self.tag)
+        cache.set(SIDEBAR_KEY, 'stale')
+        cache.set(TAG_CLOUD_KEY, 'stale')
+
+        page_cache.set('page', b'content', 'text/html', False, tags=('tag', ))
+
+        article.status = 2
+        article.save()
+        self.assertIsNone(cache.get(SIDEBAR_KEY))
+        self.assertIsNone(cache.get(TAG_CLOUD_KEY))
+        self.assertIsNone(page_cache.get('page'))
+
 
 class CommentModelTestCase(TestCase):
     def setUp(self):
@@ -150,6 +573,45 @@ class CommentModelTestCase(TestCase):
                    '<p><a href="http://qinxuye.me" rel="nofollow">http://qinxuye.me</a></p>'
         self.assertEqual(comment.content, expected)
 
+    def test_comment_avatar(self):
+        comment = Comment(avatar='http://www.gravatar.com/avatar/abc?s=80')
+        self.assertEqual(comment.avatar_42, 'http://www.gravatar.com/avatar/abc?s=42&d=404')
+        self.assertIn('avatar_42', comment.__dict__)
+
+        comment = Comment(avatar='http://qinxuye.me/avatar.jpg')
+        self.assertEqual(comment.avatar_42, 'http://qinxuye.me/avatar.jpg')
+        self.assertRaises(AttributeError, getattr, comment, 'avatar_x')
+
+    def test_comment_tree(self):
+        cache.clear()
+        content_type = ContentType.objects.get_for_model(Article)
+
+        def comment(text, parent=None, visible=True):
+            return Comment.objects.create(
+                username='abc', email_address='abc@abc.com', content_markdown=text,
+                content_type=content_type, object_id=self.article.pk,
+                reply_to_comment=parent, visible=visible
+            )
+
+        c1 = comment('c1')
+        c2 = comment('c2', parent=c1)
+        hidden = comment('hidden', parent=c1, visible=False)
+        comment('c3', parent=hidden)
+        c4 = comment('c4')
+
+        with self.assertNumQueries(1):
+            tree = self.article.comment_tree
+        self.assertEqual([c.pk for c in tree], [c4.pk, c1.pk])
+        self.assertEqual([c.pk for c in tree[1].replies], [c2.pk])
+        self.assertIn('avatar_42', tree[1].replies[0].__dict__)
+
+        with self.assertNumQueries(0):
+            self.article.comment_tree
+
+        c5 = comment('c5', parent=c2)
+        tree = self.article.comment_tree
+        self.assertEqual([c.pk for c in tree[1].replies[0].replies], [c5.pk])
+
 
 class BlogUserModelTestCase(TestCase):
     def test_blog_user_save(self):
@@ -161,3 +623,371 @@ class BlogUserModelTestCase(TestCase):
         expect = '<h1>this title</h1>\n' \
                  '<p>word</p>'
         self.assertEqual(blog_user.info, expect)
+
+
+class SidebarCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        sidebar_stats.reset()
+        User.objects.create_user(username=settings.ADMINS[0][0], password='abc')
+
+    def test_sidebar_cache_invalidation(self):
+        request = RequestFactory().get('/')
+
+        _basic_response(request)
+        commons = _basic_response(request)
+        self.assertEqual(sidebar_stats.misses, 2)
+        self.assertEqual(sidebar_stats.hits, 2)
+        self.assertEqual(len(commons['categories']), 0)
+
+        Category.objects.create(name='cate1', slug='cate1')
+        commons = _basic_response(request)
+        self.assertEqual(sidebar_stats.misses, 3)
+        self.assertEqual(len(commons['categories']), 1)
+
+
+class PageCacheTestCase(TestCase):
+    def setUp(self):
+        page_cache.clear()
+        page_stats.reset()
+
+    def test_lru_cache(self):
+        lru = LRUCache(max_bytes=10)
+        lru.set('a', '12345', tags=('t1', ))
+        lru.set('b', '12345', tags=('t2', ))
+        lru.get('a')
+        lru.set('c', '12345')
+        self.assertIn('a', lru)
+        self.assertNotIn('b', lru)
+
+        lru.invalidate('t1')
+        self.assertNotIn('a', lru)
+        self.assertEqual(lru.size, 5)
+
+    def test_cache_page_response(self):
+        @cache_page_response(tags=('category', ))
+        def view(request):
+            return HttpResponse('<input value="%s" />' % get_token(request))
+
+        def get():
+            request = RequestFactory().get('/')
+            request.user = AnonymousUser()
+            return request, view(request)
+
+        request1, response1 = get()
+        request2, response2 = get()
+        self.assertEqual(page_stats.misses, 1)
+        self.assertEqual(page_stats.hits, 1)
+        self.assertIn(get_token(request2).encode('utf-8'), response2.content)
+        self.assertNotEqual(response1.content, response2.content)
+
+        Category.objects.create(name='cate1', slug='cate1')
+        get()
+        self.assertEqual(page_stats.misses, 2)
+
+    def test_tag_invalidates_pages(self):
+        # the tag cloud is in the sidebar of the listings
+        page_cache.set('page', b'content', 'text/html', False, tags=('tag', ))
+        Tag.objects.create(name='tag1', slug='tag1')
+        self.assertIsNone(page_cache.get('page'))
+
+
+class ConditionalPageTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def test_conditional_page(self):
+        @conditional_page
+        def view(request):
+            self.calls += 1
+            return HttpResponse('page')
+
+        def get(**headers):
+            request = RequestFactory().get('/', **headers)
+            request.user = AnonymousUser()
+            return view(request)
+
+        response = get()
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.calls, 1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(get(HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.assertEqual(self.calls, 1)
+
+        Category.objects.create(name='cate1', slug='cate1')
+        self.assertEqual(get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(get(HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+        self.assertEqual(self.calls, 3)
+
+
+@override_settings(EMAIL_BACKEND='blog.mail.ThroughputBackend')
+class MailQueueTestCase(TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        ThroughputBackend.reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_dir)
+
+    def test_deliver_batch(self):
+        queue = MailQueue(os.path.join(self.spool_dir, 'spool.sqlite3'))
+        for i in range(5):
+            queue.spool.put({'parts': [{'subject': 'subject%s' % i, 'body': 'body',
+                                        'html': '<p>body</p>'}],
+                             'from_email': 'abc@abc.com', 'to': ['def@def.com']})
+
+        # spooled mails survive a restart
+        queue = MailQueue(queue.spool_path)
+        self.assertEqual(queue.deliver(), 5)
+        self.assertEqual(len(queue.spool), 0)
+        self.assertEqual(len(ThroughputBackend.outbox), 5)
+        self.assertEqual(ThroughputBackend.connections, 1)
+        self.assertGreater(ThroughputBackend.throughput(), 0)
+
+    def test_digest(self):
+        queue = MailQueue(os.path.join(self.spool_dir, 'spool.sqlite3'))
+        for i in range(3):
+            queue.spool.put({'parts': [{'subject': 'subject%s' % i, 'body': 'body%s' % i,
+                                        'html': None}],
+                             'from_email': 'abc@abc.com', 'to': ['def@def.com']},
+                            digest='def@def.com')
+
+        self.assertEqual(len(queue.spool), 1)
+        self.assertEqual(queue.deliver(), 1)
+        message = ThroughputBackend.outbox[0]
+        self.assertEqual(message.subject, settings.EMAIL_DIGEST_SUBJECT % 3)
+        self.assertIn('body2', message.body)
+
+    def test_digest_html(self):
+        queue = MailQueue(os.path.join(self.spool_dir, 'spool.sqlite3'))
+        for body, html in (('<body1>', None), ('body2', '<p>body2</p>')):
+            queue.spool.put({'parts': [{'subject': 'subject', 'body': body, 'html': html}],
+                             'from_email': 'abc@abc.com', 'to': ['def@def.com']},
+                            digest='def@def.com')
+
+        queue.deliver()
+        html = ThroughputBackend.outbox[0].alternatives[0][0]
+        # the plain text parts are escaped
+        self.assertIn('&lt;body1&gt;', html)
+        self.assertIn('<p>body2</p>', html)
+
+    def test_former_spool(self):
+        path = os.path.join(self.spool_dir, 'spool.sqlite3')
+        db = sqlite3.connect(path)
+        db.execute('CREATE TABLE mail (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                   'message TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, '
+                   'next_try REAL NOT NULL, claimed REAL)')
+        db.execute('INSERT INTO mail (message, next_try) VALUES (?, 0)', (json.dumps({
+            'subject': 'subject', 'body': 'body', 'html': None,
+            'from_email': 'abc@abc.com', 'to': ['def@def.com']}), ))
+        db.commit()
+        db.close()
+
+        queue = MailQueue(path)
+        self.assertEqual(queue.deliver(), 1)
+        self.assertEqual(len(queue.spool), 0)
+        self.assertEqual(ThroughputBackend.outbox[0].subject, 'subject')
+
+
+class AssetsTestCase(TestCase):
+    def setUp(self):
+        self.build_dir = tempfile.mkdtemp()
+        self.settings = override_settings(ASSET_BUILD_DIR=self.build_dir)
+        self.settings.enable()
+        reset_manifest()
+
+    def tearDown(self):
+        self.settings.disable()
+        reset_manifest()
+        shutil.rmtree(self.build_dir)
+
+    def test_build_assets(self):
+        name = 'blog/imperfect/css/main.css'
+        self.assertEqual(asset_url(name), settings.STATIC_URL + name)
+
+        call_command('build_assets', stdout=StringIO(), stderr=StringIO())
+        url = asset_url(name)
+        self.assertTrue(url.startswith(settings.ASSET_BUILD_URL))
+        self.assertNotEqual(url, settings.ASSET_BUILD_URL + name)
+
+        path = url[len(settings.ASSET_BUILD_URL):]
+        with open(os.path.join(self.build_dir, path)) as fp:
+            css = fp.read()
+        # font-awesome is inlined and its fonts fingerprinted
+        self.assertIn('FontAwesome', css)
+        self.assertNotIn('../fonts/', css)
+
+        request = RequestFactory().get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        response = serve_asset(request, path)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('immutable', response['Cache-Control'])
+
+
+class StylesheetsTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.root, 'sass')
+        os.makedirs(os.path.join(self.source_dir, 'base'))
+        self._write('main.scss', "@import 'base/page';\n@import 'font-awesome.min.css';\n"
+                                 "#header { a { color: $color; } }\n.other { color: red; }")
+        self._write('ie9.scss', "#main { display: none; }")
+        self._write('base/_page.scss', "$color: #000;\nbody { margin: 0; }")
+        self.project = SassProject(self.source_dir, os.path.join(self.root, 'css'),
+                                   os.path.join(self.root, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, name, content):
+        with open(os.path.join(self.source_dir, name), 'w') as fp:
+            fp.write(content)
+
+    def test_dependency_graph(self):
+        main, ie9 = [os.path.join(self.source_dir, n) for n in ('main.scss', 'ie9.scss')]
+        self.assertEqual(self.project.entrypoints(), [ie9, main])
+        self.assertEqual(self.project.closure(main),
+                         set([main, os.path.join(self.source_dir, 'base', '_page.scss')]))
+
+        digests = [self.project.digest(main), self.project.digest(ie9)]
+        self._write('base/_page.scss', "$color: #fff;\nbody { margin: 0; }")
+        self.assertNotEqual(self.project.digest(main), digests[0])
+        self.assertEqual(self.project.digest(ie9), digests[1])
+
+    @unittest.skipIf(sass is None, 'libsass is not installed')
+    def test_incremental_build(self):
+        states = dict((os.path.basename(e), s) for e, s in self.project.build())
+        self.assertEqual(states, {'main.scss': 'compiled', 'ie9.scss': 'compiled'})
+
+        self._write('base/_page.scss', "$color: #fff;\nbody { margin: 0; }")
+        states = dict((os.path.basename(e), s) for e, s in self.project.build())
+        self.assertEqual(states, {'main.scss': 'compiled', 'ie9.scss': 'unchanged'})
+
+        # back to the former sources, served from the cache
+        self._write('base/_page.scss', "$color: #000;\nbody { margin: 0; }")
+        states = dict((os.path.basename(e), s) for e, s in self.project.build())
+        self.assertEqual(states['main.scss'], 'cached')
+
+    def test_extract_critical(self):
+        css = ("@import url(font-awesome.min.css);\n"
+               "/* header */ #header a, .other a { color: red; }\n"
+               ".other { color: blue; }\n"
+               "@media screen and (max-width: 480px) { body { font-size: 12pt; } .other { top: 0; } }\n"
+               "@font-face { font-family: 'x'; }")
+        self.assertEqual(extract_critical(css, ('#header', 'body')),
+                         '#header a{color: red;}\n'
+                         '@media screen and (max-width: 480px){body{font-size: 12pt;}}')
+
+
+class FeedTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        blog_user = BlogUser.objects.create(
+            user=User.objects.create_user(username='abc', password='abc'),
+        )
+        self.cate1 = Category.objects.create(name='cate1', slug='cate1')
+        for i in range(3):
+            Article.objects.create(
+                title='test%s' % i, slug='test%s' % i,
+                content_markdown='summary%s\n\n<p><!-- pagebreak --></p>\n\nrest%s' % (i, i),
+                author=blog_user, category=self.cate1, status=2
+            )
+
+    def test_feed(self):
+        response = self.client.get('/feed/rss/')
+        self.assertEqual(response.status_code, 200)
+        body = b''.join(response.streaming_content)
+        self.assertIn(b'<title>test2</title>', body)
+        self.assertIn(b'<link>http://testserver/article/test2/</link>', body)
+        self.assertIn(b'summary2', body)
+        self.assertNotIn(b'rest2', body)
+        etag = response['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/feed/rss/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/feed/rss/')
+        self.assertEqual(response.content, body)
+
+        article = Article.objects.get(slug='test0')
+        article.title = 'test3'
+        article.save()
+        response = self.client.get('/feed/rss/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<title>test3</title>', b''.join(response.streaming_content))
+
+    def test_feed_last_modified(self):
+        response = self.client.get('/feed/rss/')
+        b''.join(response.streaming_content)
+        last_modified = response['Last-Modified']
+        response = self.client.get('/feed/rss/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        # a hidden article leaves the newest modified as it was
+        article = Article.objects.get(slug='test0')
+        article.status = 3
+        article.save()
+        response = self.client.get('/feed/rss/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+    def test_feed_host(self):
+        response = self.client.get('/feed/rss/')
+        b''.join(response.streaming_content)
+
+        response = self.client.get('/feed/rss/', HTTP_HOST='example.com')
+        body = b''.join(response.streaming_content)
+        self.assertIn(b'<link>http://example.com/article/test2/</link>', body)
+
+    def test_category_feed(self):
+        response = self.client.get('/category/cate1/feed/atom/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<entry>', b''.join(response.streaming_content))
+
+        self.assertEqual(self.client.get('/category/cate2/feed/atom/').status_code, 404)
+
+
+class PageTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        page_cache.clear()
+        blog_user = BlogUser.objects.create(
+            user=User.objects.create_user(username=settings.ADMINS[0][0], password='abc'),
+        )
+        cate1 = Category.objects.create(name='cate1', slug='cate1')
+        tag = Tag.objects.create(name='tag1', slug='tag1')
+        self.article = Article.objects.create(
+            title='test1', slug='test1', content_markdown='content1',
+            author=blog_user, category=cate1, status=2
+        )
+        ArticleTag.objects.create(article=self.article, tag=tag)
+        Article.objects.create(
+            title='test2', slug='test2', content_markdown='content2',
+            author=blog_user, category=cate1
+        )
+
+    def test_article(self):
+        response = self.client.get(self.article.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'content1')
+        self.assertContains(response, 'href="/tag/tag1/"')
+
+        self.assertEqual(self.client.get('/article/test2/').status_code, 404)
+
+    def test_category_and_tag(self):
+        for path in ('/category/cate1/', '/tag/tag1/'):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, 'href="/article/test1/"')
+            self.assertNotContains(response, 'test2')
+
+        self.assertEqual(self.client.get('/category/cate2/').status_code, 404)
+        self.assertEqual(self.client.get('/tag/tag1/page/2/').status_code, 404)
+
+    def test_search_form(self):
+        response = self.client.get('/search/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'name="q"')
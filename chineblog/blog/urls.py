@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2016 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from django.conf.urls import url
+
+from . import views
+
+
+urlpatterns = [
+    url(r'^$', views.index, name='blog_index'),
+    url(r'^page/(?P<page>\d+)/$', views.index, name='blog_page'),
+    url(r'^search/$', views.search, name='blog_search'),
+    url(r'^article/(?P<slug>[\w-]+)/$', views.article, name='blog_article'),
+    url(r'^category/(?P<slug>[\w-]+)/$', views.category, name='blog_category'),
+    url(r'^category/(?P<slug>[\w-]+)/page/(?P<page>\d+)/$',
+        views.category, name='blog_category_page'),
+    url(r'^tag/(?P<slug>[\w-]+)/$', views.tag, name='blog_tag'),
+    url(r'^tag/(?P<slug>[\w-]+)/page/(?P<page>\d+)/$', views.tag, name='blog_tag_page'),
+    url(r'^feed/(?P<feed_type>rss|atom)/$', views.feed, name='blog_feed'),
+    url(r'^category/(?P<slug>[\w-]+)/feed/(?P<feed_type>rss|atom)/$',
+        views.category_feed, name='blog_category_feed'),
+    url(r'^tag/(?P<slug>[\w-]+)/feed/(?P<feed_type>rss|atom)/$',
+        views.tag_feed, name='blog_tag_feed'),
+]
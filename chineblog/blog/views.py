@@ -16,22 +16,36 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from django.shortcuts import render_to_response
+import os
+import mimetypes
+
+from django.shortcuts import render_to_response, get_object_or_404
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.context_processors import csrf
 from django.core.paginator import Paginator, EmptyPage
+from django.core.urlresolvers import reverse
 from django.http import Http404
+from django.utils.cache import patch_vary_headers
+from django.views.static import serve
 
-from .models import BlogUser, Category, Article, Link
+from .models import BlogUser, Category, Article, Link, Tag
+from .search import search_service
+from .caching import cached, cache_page_response, sidebar_stats, LRUCache, \
+    SIDEBAR_KEY, POPULARS_KEY
+from .pagination import KeysetPaginator
+from .tagcloud import get_tag_cloud
+from .assets import MANIFEST_NAME
+from .feeds import feed_response
+from .conditional import conditional_page
 
 
 admin = settings.ADMINS[0][0]
 
 
-def _basic_response(request):
+def _get_author():
     try:
-        author = BlogUser.objects.get(user__username=admin)
+        author = BlogUser.objects.select_related('user').get(user__username=admin)
     except BlogUser.DoesNotExist:
         user = User.objects.get(username=admin)
         info = 'Define the user info in the admin interface'  # Define the admin info
@@ -40,36 +54,68 @@ def _basic_response(request):
         author = BlogUser.objects.create(
             small_avatar=avatar, info_markdown=info, user=user)
 
-    commons = {
-        'author': author,
-        'categories': Category.objects.all(),
-        'populars': Article.objects.order_by('-pvs')[:5],
-        'links': Link.objects.all(),
-        'debug': settings.DEBUG,
+    return author
+
+
+def _sidebar_context():
+    return {
+        'author': _get_author(),
+        'categories': list(Category.objects.all()),
+        'links': list(Link.objects.all()),
     }
+
+
+def _populars():
+    return list(Article.visible_objects.for_sidebar().order_by('-pvs')[:5])
+
+
+def _basic_response(request):
+    # sidebar is invalidated by signals, populars refresh on an interval
+    commons = dict(cached(SIDEBAR_KEY, _sidebar_context,
+                          timeout=settings.SIDEBAR_CACHE_TIMEOUT,
+                          stats=sidebar_stats))
+    commons['populars'] = cached(POPULARS_KEY, _populars,
+                                 timeout=settings.SIDEBAR_POPULARS_INTERVAL,
+                                 stats=sidebar_stats)
+    commons['tag_cloud'] = get_tag_cloud(shuffle=settings.TAG_CLOUD_SHUFFLE)
+    commons['debug'] = settings.DEBUG
     commons.update(csrf(request))
     return commons
 
 
+_page_links = LRUCache(max_entries=1000)
+
+
+def _get_page_links(page, size):
+    # the link windows only depend on the page and the number of pages
+    links = _page_links.get((page, size))
+    if links is not None:
+        return links
+
+    half = settings.PAGE_ENTRY_DISPLAY_NUM // 2
+    edge = settings.PAGE_ENTRY_EDGE_NUM
+
+    links = {
+        'left_continual_max': edge + half + 1,
+        'left_edge_range': list(range(1, edge + 1)),
+        'left_continual_range': list(range(1, page)),
+        'left_range': list(range(page - half, page)),
+        'right_continual_min': size - half - 1
+        if settings.PAGE_ENTRY_DISPLAY_NUM % 2 == 0 else half,
+        'right_continual_range': list(range(page + 1, size + 1)),
+        'right_edge_range': list(range(size - edge + 1, size + 1)),
+        'right_range': list(range(page + 1, page + edge + 1)),
+    }
+    _page_links.set((page, size), links)
+    return links
+
+
 def _paginator_response(request, page, p):
-    # p is an instance of Paginator
+    # p is an instance of Paginator or KeysetPaginator
     page = int(page)
-    size = p.num_pages
-
-    left_continual_max = settings.PAGE_ENTRY_EDGE_NUM + settings.PAGE_ENTRY_DISPLAY_NUM / 2 + 1
-    left_edge_range = range(1, settings.PAGE_ENTRY_EDGE_NUM + 1)
-    left_continual_range = range(1, page)
-    left_range = range(page - settings.PAGE_ENTRY_DISPLAY_NUM / 2, page)
-
-    right_continual_min = size - settings.PAGE_ENTRY_DISPLAY_NUM / 2 - 1 \
-        if settings.PAGE_ENTRY_DISPLAY_NUM % 2 == 0 \
-        else settings.PAGE_ENTRY_DISPLAY_NUM / 2
-    right_continual_range = range(page + 1, size + 1)
-    right_edge_range = range(size - settings.PAGE_ENTRY_EDGE_NUM + 1, size + 1)
-    right_range = range(page + 1, page + settings.PAGE_ENTRY_EDGE_NUM + 1)
-
-    d = locals()
-    del d['size']
+
+    d = dict(_get_page_links(page, p.num_pages))
+    d.update(request=request, page=page, p=p)
     return d
 
 
@@ -97,8 +143,62 @@ def _handle_session(request, save=False, **kwargs):
             request.session['comment_user'] = session_data
 
 
+@conditional_page
+# the tag cloud of the sidebar is shown too
+@cache_page_response(tags=('article', 'articletag', 'tag', 'category', 'link', 'comment',
+                           'bloguser'))
 def index(request, page=1):
-    p = Paginator(Article.visible_objects.all(), settings.PAGE_SIZE)
+    listing = Article.visible_objects.for_listing()
+    if settings.PAGINATION_MODE == 'keyset':
+        p = KeysetPaginator(listing, settings.PAGE_SIZE, 'index')
+    else:
+        p = Paginator(listing, settings.PAGE_SIZE)
+    try:
+        after = request.GET.get('after')
+        if after and settings.PAGINATION_MODE == 'keyset':
+            current_page = p.page_after(after)
+            page = current_page.number
+        else:
+            current_page = p.page(page)
+    except EmptyPage:
+        raise Http404
+
+    data = locals()
+    data.update(_basic_response(request))
+    data.update(_paginator_response(request, page, p))
+
+    blog_theme = settings.BLOG_THEME
+    return render_to_response('blog/{0}/index.html'.format(blog_theme), data)
+
+
+@conditional_page
+# the tag cloud of the sidebar is shown too
+@cache_page_response(tags=('article', 'articletag', 'tag', 'category', 'link', 'comment',
+                           'bloguser'))
+def category(request, slug, page=1):
+    category = get_object_or_404(Category, slug=slug)
+    p = Paginator(Article.visible_objects.for_listing().filter(category=category),
+                  settings.PAGE_SIZE)
+    try:
+        current_page = p.page(page)
+    except EmptyPage:
+        raise Http404
+
+    data = locals()
+    data.update(_basic_response(request))
+    data.update(_paginator_response(request, page, p))
+
+    blog_theme = settings.BLOG_THEME
+    return render_to_response('blog/{0}/index.html'.format(blog_theme), data)
+
+
+@conditional_page
+@cache_page_response(tags=('article', 'articletag', 'tag', 'category', 'link', 'comment',
+                           'bloguser'))
+def tag(request, slug, page=1):
+    tag = get_object_or_404(Tag, slug=slug)
+    p = Paginator(Article.visible_objects.for_listing().filter(articletag__tag=tag),
+                  settings.PAGE_SIZE)
     try:
         current_page = p.page(page)
     except EmptyPage:
@@ -110,3 +210,85 @@ def index(request, page=1):
 
     blog_theme = settings.BLOG_THEME
     return render_to_response('blog/{0}/index.html'.format(blog_theme), data)
+
+
+def article(request, slug):
+    # not a conditional page, every read is counted
+    article = Article.visible_objects.select_related('category', 'author__user') \
+        .filter(slug=slug).first()
+    if article is None:
+        raise Http404
+    article.on_click(request.session)
+
+    data = locals()
+    data.update(_basic_response(request))
+
+    blog_theme = settings.BLOG_THEME
+    return render_to_response('blog/{0}/article.html'.format(blog_theme), data)
+
+
+@conditional_page
+def search(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        raise Http404
+    if page < 1:
+        raise Http404
+
+    results = search_service.search(query, page) if query else None
+
+    data = locals()
+    data.update(_basic_response(request))
+
+    blog_theme = settings.BLOG_THEME
+    return render_to_response('blog/{0}/search.html'.format(blog_theme), data)
+
+
+def feed(request, feed_type):
+    return feed_response(request, feed_type, 'site', settings.FEED_TITLE,
+                         reverse('blog_index'), Article.visible_objects.all())
+
+
+def category_feed(request, slug, feed_type):
+    category = get_object_or_404(Category, slug=slug)
+    return feed_response(request, feed_type, 'category:%s' % category.pk,
+                         '%s - %s' % (category.name, settings.FEED_TITLE),
+                         category.get_absolute_url(),
+                         Article.visible_objects.filter(category=category))
+
+
+def tag_feed(request, slug, feed_type):
+    tag = get_object_or_404(Tag, slug=slug)
+    return feed_response(request, feed_type, 'tag:%s' % tag.pk,
+                         '%s - %s' % (tag.name, settings.FEED_TITLE),
+                         tag.get_absolute_url(),
+                         Article.visible_objects.filter(articletag__tag=tag))
+
+
+def serve_asset(request, path):
+    """
+    Serve a built asset, its names are fingerprinted so they never change.
+    The precompressed sibling is served to the clients accepting it.
+    """
+    if path == MANIFEST_NAME:
+        raise Http404
+
+    root = settings.ASSET_BUILD_DIR
+    accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    encoding = None
+    for suffix, name in (('.br', 'br'), ('.gz', 'gzip')):
+        if name in accepted and os.path.isfile(os.path.join(root, path + suffix)):
+            encoding = name
+            break
+
+    if encoding is None:
+        response = serve(request, path, document_root=root)
+    else:
+        response = serve(request, path + suffix, document_root=root)
+        response['Content-Type'] = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ('Accept-Encoding', ))
+    response['Cache-Control'] = 'public, max-age=%s, immutable' % settings.ASSET_MAX_AGE
+    return response
@@ -155,6 +155,38 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'blog', 'static')
 ]
 
+# `manage.py build_assets` writes the bundles with fingerprinted names here,
+# they are served with far future cache headers
+ASSET_BUILD_DIR = os.path.join(BASE_DIR, 'blog', 'static', 'build')
+ASSET_BUILD_URL = STATIC_URL + 'build/'
+ASSET_BUNDLES = {
+    'blog/imperfect/css/main.css': ['blog/imperfect/css/main.css'],
+    'blog/imperfect/css/ie8.css': ['blog/imperfect/css/ie8.css'],
+    'blog/imperfect/css/ie9.css': ['blog/imperfect/css/ie9.css'],
+    'blog/imperfect/js/main.js': [
+        'blog/imperfect/js/jquery.min.js',
+        'blog/imperfect/js/skel.min.js',
+        'blog/imperfect/js/util.js',
+        'blog/imperfect/js/main.js',
+    ],
+    'blog/imperfect/js/ie/html5shiv.js': ['blog/imperfect/js/ie/html5shiv.js'],
+    'blog/imperfect/images/chine.ico': ['blog/imperfect/images/chine.ico'],
+}
+ASSET_MAX_AGE = 365 * 24 * 60 * 60  # seconds
+
+# `manage.py build_sass` compiles the theme sources whose imports changed,
+# needs libsass
+SASS_SOURCE_DIR = os.path.join(BASE_DIR, 'blog', 'static', 'blog', 'imperfect', 'sass')
+SASS_OUTPUT_DIR = os.path.join(BASE_DIR, 'blog', 'static', 'blog', 'imperfect', 'css')
+SASS_CACHE_DIR = os.path.join(BASE_DIR, '.sass-cache')
+SASS_OUTPUT_STYLE = 'expanded'
+# rules of these selectors in main.css are inlined as critical.css
+SASS_CRITICAL_SOURCE = 'main.css'
+SASS_CRITICAL_SELECTORS = (
+    'html', 'body', 'a', 'h1', 'h2', 'h3', 'p',
+    '#wrapper', '#header', '#main', '#intro', '.post',
+)
+
 
 # MEDIA relative
 
@@ -164,21 +196,88 @@ MEDIA_URL = '/static/uploads/'
 
 # Index dir for search
 INDEX_DIR = os.path.join(BASE_DIR, 'index')
+# analyzer of the title and content, `cjk` or `standard`
+SEARCH_ANALYZER = 'cjk'
+# words for the chinese segmentation, one per line (jieba's dict.txt works).
+# No dictionary ships with the blog, without one the chinese runs are
+# indexed as bigrams
+SEARCH_DICTIONARY = None
+# index updates are committed in batches on a background thread
+SEARCH_ASYNC_INDEX = True
+SEARCH_BATCH_SIZE = 50
+SEARCH_COMMIT_INTERVAL = 2  # seconds
+# merge all the segments into one every n commits
+SEARCH_OPTIMIZE_EVERY = 20
+# searchers check for a newer index at most every n seconds
+SEARCH_REFRESH_INTERVAL = 5
+SEARCH_PAGE_SIZE = 10
+# number of result pages cached
+SEARCH_CACHE_SIZE = 500
+
+# memory bound of the rendered markdown kept for reuse
+MARKDOWN_CACHE_MAX_BYTES = 16 * 1024 * 1024
+# articles whose markdown is at least this long are rendered by a pool of
+# worker processes after the save, None to always render in the request
+ASYNC_RENDER_THRESHOLD = None
+ASYNC_RENDER_WORKERS = None  # default to the number of cpus
 
 # Theme
 BLOG_THEME = 'imperfect'
 
 # Blog display settings
 PAGE_SIZE = 5
+# `keyset` seeks on (-on_top, -created, id), `offset` uses the django Paginator
+PAGINATION_MODE = 'keyset'
+# page boundaries and count, invalidated when an article is saved
+PAGINATION_CACHE_TIMEOUT = 24 * 60 * 60
 PAGE_ENTRY_DISPLAY_NUM = 6
 PAGE_ENTRY_EDGE_NUM = 2
+# feeds of the site, of each category and tag
+FEED_TITLE = '残阳似血的博客'
+FEED_SIZE = 20
+FEED_CACHE_TIMEOUT = 24 * 60 * 60
+# sidebar cache, invalidated when categories, links or the user change
+SIDEBAR_CACHE_TIMEOUT = 24 * 60 * 60
+# seconds between two refreshes of the popular articles
+SIDEBAR_POPULARS_INTERVAL = 10 * 60
+# page cache for anonymous visitors, kept in the memory of each process
+PAGE_CACHE_ENABLED = True
+PAGE_CACHE_TIMEOUT = 10 * 60
+PAGE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# comment trees of each article, invalidated when a comment is saved
+COMMENT_TREE_CACHE_TIMEOUT = 24 * 60 * 60
+# avatar sizes resolved in bulk for the comments
+AVATAR_SIZES = (42, 64)
 # tag
 MAX_FONT_SIZE = 32
 MIN_FONT_SIZE = 12
 MINUS_FONT_SIZE = MAX_FONT_SIZE - MIN_FONT_SIZE
+# display the tag cloud in a random order
+TAG_CLOUD_SHUFFLE = True
+TAG_CLOUD_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Counters, pv/uv/likes are flushed to the database in batches
+COUNTER_FLUSH_INTERVAL = 10  # seconds
+# set a file path to share the pending counters between processes
+COUNTER_SPOOL_FILE = None
+# bloom filters in the session to dedup the reads and likes of a visitor
+SESSION_BLOOM_BITS = 2048
+SESSION_BLOOM_HASHES = 4
+# HyperLogLog registers of the per-article uv estimation, 2 ** precision
+UV_HLL_PRECISION = 10
 
 # Email
 ENABLE_EMAIL = False
+# mails are spooled in a local SQLite file and sent by a pool of threads
+EMAIL_SPOOL_PATH = os.path.join(BASE_DIR, 'mail_spool.sqlite3')
+EMAIL_WORKERS = 2
+EMAIL_BATCH_SIZE = 20
+EMAIL_POLL_INTERVAL = 30  # seconds
+EMAIL_RETRY_DELAY = 60  # seconds, doubled on each attempt
+EMAIL_MAX_ATTEMPTS = 5
+# group the notifications to the same recipient within n seconds, 0 to disable
+EMAIL_DIGEST_WINDOW = 0
+EMAIL_DIGEST_SUBJECT = '【残阳似血的博客】上有%s条新的评论和留言'
 
 # Needed install: PIL
 # Grappelli
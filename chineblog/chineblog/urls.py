@@ -19,6 +19,8 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from filebrowser.sites import site
 
+from blog.views import serve_asset
+
 urlpatterns = [
     url(r'^admin/filebrowser/', include(site.urls)),
     url(r'^grappelli/', include('grappelli.urls')),  # grappelli URLS
@@ -29,4 +31,13 @@ urlpatterns += [
     url(r'^markdown/', include('django_markdown.urls')),
 ]
 
+urlpatterns += [
+    url(r'^', include('blog.urls')),
+]
+
+# fingerprinted assets, before the plain static files
+urlpatterns += [
+    url(r'^%s(?P<path>.+)$' % settings.ASSET_BUILD_URL.lstrip('/'), serve_asset),
+]
+
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file